@@ -1,13 +1,31 @@
+import abc
 import argparse
+import codecs
+import functools
+import gzip
+import hashlib
+import hmac
+import io
+import ipaddress
 import json
 import os
+import re
+import secrets
+import shutil
+import socket
 import sqlite3
+import struct
 import subprocess
 import sys
+import tempfile
+import textwrap
+import unicodedata
 import uuid
 import stat
-from datetime import datetime
+import zlib
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from urllib.parse import urlsplit
 
 # Windows平台特定导入
 if sys.platform == 'win32':
@@ -20,11 +38,62 @@ else:
 # 全局数据库连接对象
 conn = None
 
+# 是否运行在常驻预热进程中（常驻进程保持数据库连接和后端连接池）
+RESIDENT = False
 
-# 数据库路径（修改：使用sys.executable定位exe所在目录）
+
+# 数据库路径（修改：使用sys.executable定位exe所在目录，可通过AI_DB_PATH指定）
 DB_PATH = Path(sys.executable).parent / "ai_chat_history.db" if getattr(sys, 'frozen', False) else Path(__file__).parent / "ai_chat_history.db"
+if os.environ.get('AI_DB_PATH'):
+    DB_PATH = Path(os.environ['AI_DB_PATH'])
 SCHEMA_PATH = Path(__file__).parent / "schema.sql"
 
+# 后端配置：aichat（子进程，默认）或 openai（进程内HTTP客户端，兼容OpenAI接口）
+BACKEND_NAME = os.environ.get('AI_BACKEND', 'aichat')
+API_BASE_URL = os.environ.get('AI_BASE_URL', os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1'))
+API_KEY = os.environ.get('AI_API_KEY', os.environ.get('OPENAI_API_KEY', ''))
+API_MODEL = os.environ.get('AI_MODEL', 'gpt-4o-mini')
+API_TIMEOUT = float(os.environ.get('AI_TIMEOUT', '60'))
+
+# 代码执行模式输出捕获：数据库只保留头尾窗口，完整输出可选写入压缩文件
+OUTPUT_HEAD_BYTES = int(os.environ.get('AI_OUTPUT_HEAD', 16 * 1024))
+OUTPUT_TAIL_BYTES = int(os.environ.get('AI_OUTPUT_TAIL', 16 * 1024))
+OUTPUT_SPILL_DIR = os.environ.get('AI_OUTPUT_SPILL_DIR', '')
+
+# 最近一次代码执行模式的捕获结果
+last_capture = None
+
+# 常驻进程为终端客户端执行请求时，客户端终端的列数（此时输出写入套接字，但仍需渲染）
+client_terminal_columns = None
+
+# 用量统计：每千token单价（用于估算费用）和会话上下文预算（token数）
+PRICE_PROMPT = float(os.environ.get('AI_PRICE_PROMPT', '0'))
+PRICE_COMPLETION = float(os.environ.get('AI_PRICE_COMPLETION', '0'))
+CONTEXT_BUDGET = int(os.environ.get('AI_CONTEXT_BUDGET', '8000'))
+
+# 常驻预热进程：空闲超时秒数，以及POSIX下的套接字路径 / Windows下记录端口的标记文件
+# POSIX下套接字放在仅当前用户可访问（0700）的目录中，可通过AI_PREFETCH_DIR指定
+PREFETCH_IDLE_TIMEOUT = int(os.environ.get('AI_PREFETCH_IDLE_TIMEOUT', '600'))
+if sys.platform == 'win32':
+    PREFETCH_DIR = Path(os.environ.get('AI_PREFETCH_DIR') or tempfile.gettempdir())
+    PREFETCH_SOCKET = PREFETCH_DIR / "ai-prefetch.port"
+else:
+    PREFETCH_DIR = Path(os.environ.get('AI_PREFETCH_DIR') or os.environ.get('XDG_RUNTIME_DIR')
+                        or Path(tempfile.gettempdir()) / f"ai-prefetch-{os.getuid()}")
+    PREFETCH_SOCKET = PREFETCH_DIR / "ai-prefetch.sock"
+
+# 数据库必须包含的表
+REQUIRED_TABLES = ['chat_history', 'sessions', 'session_messages', 'usage_log', 'usage_hourly', 'usage_daily',
+                   'sync_state', 'sync_peers']
+
+# 同步：socket传输的认证令牌（为空则不校验，此时只允许监听本机地址）
+SYNC_TOKEN = os.environ.get('AI_SYNC_TOKEN', '')
+# 同步数据大小上限：单帧压缩后的字节数，以及解压后的字节数
+SYNC_MAX_FRAME_BYTES = 64 * 1024 * 1024
+SYNC_MAX_PAYLOAD_BYTES = 256 * 1024 * 1024
+# 同步数据格式错误时可能出现的异常
+SYNC_ERRORS = (OSError, ValueError, TypeError, AttributeError, sqlite3.Error)
+
 # 获取系统默认 shell
 def get_system_shell():
     """获取系统默认 shell"""
@@ -38,6 +107,9 @@ def get_system_shell():
 # 初始化数据库连接
 def init_db_connection():
     global conn
+    # 常驻进程复用已打开的连接
+    if RESIDENT and conn:
+        return conn.cursor()
     try:
         conn = sqlite3.connect(DB_PATH)
         return conn.cursor()
@@ -47,7 +119,7 @@ def init_db_connection():
 # 关闭数据库连接
 def close_db_connection():
     global conn
-    if conn:
+    if conn and not RESIDENT:
         try:
             conn.close()
         except Exception as e:
@@ -57,11 +129,13 @@ def close_db_connection():
 def init_db(cursor):
     """初始化数据库"""
     # 检查表是否存在
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name IN ('chat_history', 'sessions', 'session_messages')")
+    placeholders = ','.join('?' for _ in REQUIRED_TABLES)
+    cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name IN ({placeholders})", REQUIRED_TABLES)
     existing_tables = [row[0] for row in cursor.fetchall()]
 
-    # 如果所有表都存在，无需创建
-    if set(['chat_history', 'sessions', 'session_messages']).issubset(set(existing_tables)):
+    # 如果所有表都存在，无需创建，只需检查新增字段
+    if set(REQUIRED_TABLES).issubset(set(existing_tables)):
+        migrate_db(cursor)
         return
 
     if SCHEMA_PATH.exists():
@@ -77,7 +151,13 @@ def init_db(cursor):
             problem TEXT NOT NULL,
             answer TEXT,
             output TEXT,
-            role TEXT DEFAULT 'default'
+            role TEXT DEFAULT 'default',
+            output_bytes INTEGER,
+            output_sha256 TEXT,
+            output_file TEXT,
+            uuid TEXT,
+            origin_id TEXT,
+            seq INTEGER
         )
         ''')
         cursor.execute('''
@@ -85,7 +165,9 @@ def init_db(cursor):
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             session_id TEXT NOT NULL,
             start_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-            is_active INTEGER DEFAULT 1
+            is_active INTEGER DEFAULT 1,
+            origin_id TEXT,
+            seq INTEGER
         )
         ''')
         cursor.execute('''
@@ -93,17 +175,117 @@ def init_db(cursor):
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             session_id INTEGER,
             message_id INTEGER,
+            origin_id TEXT,
+            seq INTEGER,
             FOREIGN KEY (session_id) REFERENCES sessions(id),
             FOREIGN KEY (message_id) REFERENCES chat_history(id)
         )
         ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usage_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id INTEGER,
+            session_id INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            role TEXT DEFAULT 'default',
+            prompt_tokens INTEGER DEFAULT 0,
+            completion_tokens INTEGER DEFAULT 0,
+            context_bytes INTEGER DEFAULT 0,
+            stream_bytes INTEGER DEFAULT 0,
+            cost REAL DEFAULT 0,
+            FOREIGN KEY (message_id) REFERENCES chat_history(id),
+            FOREIGN KEY (session_id) REFERENCES sessions(id)
+        )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_log_session ON usage_log(session_id)")
+        for table in ('usage_hourly', 'usage_daily'):
+            cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                period TEXT NOT NULL,
+                role TEXT NOT NULL,
+                requests INTEGER DEFAULT 0,
+                prompt_tokens INTEGER DEFAULT 0,
+                completion_tokens INTEGER DEFAULT 0,
+                context_bytes INTEGER DEFAULT 0,
+                stream_bytes INTEGER DEFAULT 0,
+                cost REAL DEFAULT 0,
+                PRIMARY KEY (period, role)
+            )
+            ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_peers (
+            peer TEXT NOT NULL,
+            origin_id TEXT NOT NULL,
+            last_seq INTEGER DEFAULT 0,
+            PRIMARY KEY (peer, origin_id)
+        )
+        ''')
+    migrate_db(cursor)
+
+
+# 旧数据库需要补充的字段
+MIGRATION_COLUMNS = {
+    'chat_history': [
+        ('output_bytes', 'INTEGER'),
+        ('output_sha256', 'TEXT'),
+        ('output_file', 'TEXT'),
+        ('uuid', 'TEXT'),
+        ('origin_id', 'TEXT'),
+        ('seq', 'INTEGER'),
+    ],
+    'sessions': [
+        ('origin_id', 'TEXT'),
+        ('seq', 'INTEGER'),
+    ],
+    'session_messages': [
+        ('origin_id', 'TEXT'),
+        ('seq', 'INTEGER'),
+    ],
+}
+
+# 同步所需的索引（依赖上面补充的字段）
+MIGRATION_INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_history_uuid ON chat_history(uuid)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_history_origin ON chat_history(origin_id, seq)",
+    "CREATE INDEX IF NOT EXISTS idx_sessions_session_id ON sessions(session_id)",
+    "CREATE INDEX IF NOT EXISTS idx_sessions_origin ON sessions(origin_id, seq)",
+    "CREATE INDEX IF NOT EXISTS idx_session_messages_origin ON session_messages(origin_id, seq)",
+]
+
+
+def migrate_db(cursor):
+    """为旧版本数据库补充新增字段"""
+    for table, columns in MIGRATION_COLUMNS.items():
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing_columns = {row[1] for row in cursor.fetchall()}
+        for name, column_type in columns:
+            if name not in existing_columns:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+    for statement in MIGRATION_INDEXES:
+        cursor.execute(statement)
 
 # 其他数据库操作函数类似修改，添加cursor参数
-def save_chat_record(cursor, problem, answer, output, role='default'):
-    """保存聊天记录到数据库"""
+def save_chat_record(cursor, problem, answer, output, role='default', capture=None, prompt=None, context_bytes=0):
+    """保存聊天记录到数据库，capture为代码执行模式的输出捕获结果
+
+    prompt为实际发送的内容（默认为problem），context_bytes为携带的历史上下文大小，用于用量统计
+    """
+    output_bytes = output_sha256 = output_file = None
+    if capture:
+        output_bytes = capture.total_bytes
+        output_sha256 = capture.sha256
+        output_file = str(capture.spill_path) if capture.spill_path else None
+    origin_id, seq = next_change(cursor)
     cursor.execute(
-        "INSERT INTO chat_history (problem, answer, output, role) VALUES (?, ?, ?, ?)",
-        (problem, answer, output, role)
+        "INSERT INTO chat_history (problem, answer, output, role, output_bytes, output_sha256, output_file, uuid, origin_id, seq) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (problem, answer, output, role, output_bytes, output_sha256, output_file, str(uuid.uuid4()), origin_id, seq)
     )
     
     chat_id = cursor.lastrowid
@@ -114,13 +296,121 @@ def save_chat_record(cursor, problem, answer, output, role='default'):
     if session_row:
         session_id = session_row[0]
         cursor.execute(
-            "INSERT INTO session_messages (session_id, message_id) VALUES (?, ?)",
-            (session_id, chat_id)
+            "INSERT INTO session_messages (session_id, message_id, origin_id, seq) VALUES (?, ?, ?, ?)",
+            (session_id, chat_id) + next_change(cursor)
         )
+    else:
+        session_id = None
+
+    record_usage(cursor, chat_id, session_id, role, prompt if prompt is not None else problem, output, context_bytes)
     conn.commit()
     return chat_id
 
 
+# CJK字符大致按1个token计算，其他字符按4个字符1个token计算
+CJK_PATTERN = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """粗略估算文本的token数"""
+    if not text:
+        return 0
+    cjk_count = len(CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def estimate_cost(prompt_tokens, completion_tokens):
+    """按配置的每千token单价估算费用"""
+    return (prompt_tokens * PRICE_PROMPT + completion_tokens * PRICE_COMPLETION) / 1000
+
+
+def record_usage(cursor, message_id, session_id, role, prompt, output, context_bytes=0):
+    """记录单次请求的用量，并增量更新按小时和按天的汇总表"""
+    prompt_tokens = estimate_tokens(prompt)
+    completion_tokens = estimate_tokens(output)
+    stream_bytes = len(output.encode('utf-8')) if output else 0
+    cost = estimate_cost(prompt_tokens, completion_tokens)
+
+    # 明细和汇总使用同一个UTC时间（与CURRENT_TIMESTAMP格式一致），汇总可由明细重建
+    now = datetime.now(timezone.utc)
+    cursor.execute(
+        "INSERT INTO usage_log (message_id, session_id, timestamp, role, prompt_tokens, completion_tokens, context_bytes, stream_bytes, cost) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (message_id, session_id, now.strftime('%Y-%m-%d %H:%M:%S'), role,
+         prompt_tokens, completion_tokens, context_bytes, stream_bytes, cost)
+    )
+
+    for table, period in (('usage_hourly', now.strftime('%Y-%m-%d %H:00')), ('usage_daily', now.strftime('%Y-%m-%d'))):
+        cursor.execute(f"""
+            INSERT INTO {table} (period, role, requests, prompt_tokens, completion_tokens, context_bytes, stream_bytes, cost)
+            VALUES (?, ?, 1, ?, ?, ?, ?, ?)
+            ON CONFLICT (period, role) DO UPDATE SET
+                requests = requests + 1,
+                prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                completion_tokens = completion_tokens + excluded.completion_tokens,
+                context_bytes = context_bytes + excluded.context_bytes,
+                stream_bytes = stream_bytes + excluded.stream_bytes,
+                cost = cost + excluded.cost
+        """, (period, role, prompt_tokens, completion_tokens, context_bytes, stream_bytes, cost))
+
+
+def get_usage_report(cursor, period='day'):
+    """读取用量统计（UTC时间）：day为最近7天，hour为最近24小时（读汇总表），session为最近10个会话（按会话聚合明细）"""
+    if period == 'session':
+        cursor.execute("""
+            SELECT substr(s.start_time, 1, 16), u.role, COUNT(*), SUM(u.prompt_tokens), SUM(u.completion_tokens),
+                   SUM(u.context_bytes), SUM(u.stream_bytes), SUM(u.cost)
+            FROM usage_log u JOIN sessions s ON s.id = u.session_id
+            WHERE u.session_id IN (SELECT id FROM sessions ORDER BY id DESC LIMIT 10)
+            GROUP BY u.session_id, u.role ORDER BY u.session_id DESC, u.role
+        """)
+        return cursor.fetchall()
+
+    now = datetime.now(timezone.utc)
+    if period == 'hour':
+        table = 'usage_hourly'
+        since = (now - timedelta(hours=23)).strftime('%Y-%m-%d %H:00')
+    else:
+        table = 'usage_daily'
+        since = (now - timedelta(days=6)).strftime('%Y-%m-%d')
+    cursor.execute(f"""
+        SELECT period, role, requests, prompt_tokens, completion_tokens, context_bytes, stream_bytes, cost
+        FROM {table} WHERE period >= ? ORDER BY period DESC, role
+    """, (since,))
+    return cursor.fetchall()
+
+
+def format_usage_report(rows):
+    """格式化用量统计显示"""
+    if not rows:
+        return "没有用量记录"
+
+    result = [f"{'时间':<16} {'角色':<10} {'请求':>5} {'输入tok':>9} {'输出tok':>9} {'上下文KB':>9} {'输出KB':>9} {'费用':>9}"]
+    totals = [0, 0, 0, 0, 0, 0.0]
+    for period, role, requests, prompt_tokens, completion_tokens, context_bytes, stream_bytes, cost in rows:
+        result.append(f"{period:<16} {role:<10} {requests:>5} {prompt_tokens:>9} {completion_tokens:>9} "
+                      f"{context_bytes / 1024:>9.1f} {stream_bytes / 1024:>9.1f} {cost:>9.4f}")
+        for i, value in enumerate((requests, prompt_tokens, completion_tokens, context_bytes, stream_bytes, cost)):
+            totals[i] += value
+    requests, prompt_tokens, completion_tokens, context_bytes, stream_bytes, cost = totals
+    result.append(f"{'合计':<16} {'':<10} {requests:>5} {prompt_tokens:>9} {completion_tokens:>9} "
+                  f"{context_bytes / 1024:>9.1f} {stream_bytes / 1024:>9.1f} {cost:>9.4f}")
+    return "\n".join(result)
+
+
+def check_context_budget(param_list):
+    """估算历史上下文的大小，超过预算时给出提醒，返回上下文字节数"""
+    context_bytes = len(json.dumps(param_list).encode('utf-8'))
+    context_tokens = sum(estimate_tokens(item.get("problem")) + estimate_tokens(item.get("output")) for item in param_list)
+    if CONTEXT_BUDGET and context_tokens > CONTEXT_BUDGET:
+        warning = f"警告：当前上下文约 {context_tokens} tokens，已超过预算 {CONTEXT_BUDGET}"
+        cost = estimate_cost(context_tokens, 0)
+        if cost:
+            warning += f"，每次请求约花费 {cost:.4f}"
+        print(warning + "，可使用 '-m start' 开始新会话")
+    return context_bytes
+
+
 def start_session(cursor):
     """开始一个新的会话"""
     # 先将所有活跃会话设为非活跃
@@ -129,9 +419,10 @@ def start_session(cursor):
     # 创建新会话
     session_id = str(uuid.uuid4())
     cursor.execute(
-        "INSERT INTO sessions (session_id) VALUES (?)",
-        (session_id,)
+        "INSERT INTO sessions (session_id, origin_id, seq) VALUES (?, ?, ?)",
+        (session_id,) + next_change(cursor)
     )
+    conn.commit()
     return session_id
 
 
@@ -270,9 +561,292 @@ def run_command(cmd, capture_output=False, text=True, encoding='utf-8'):
     except Exception as e:
         return f"错误: 无法执行命令 - {str(e)}", None
 
-# 重构run_aichat_command函数
-def run_aichat_command(args, history_param=None):
-    """运行aichat命令并捕获输出"""
+class CapturedOutput:
+    """命令输出的捕获结果：头尾窗口文本、总字节数、哈希和可选的完整输出文件"""
+
+    def __init__(self, text, total_bytes, sha256, spill_path=None, returncode=None):
+        self.text = text
+        self.total_bytes = total_bytes
+        self.sha256 = sha256
+        self.spill_path = spill_path
+        self.returncode = returncode
+
+
+def decode_output(data, partial=False):
+    """解码命令输出，Windows下UTF-8失败时回退到GBK（中文系统默认）"""
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        # 尾部窗口可能从多字节字符中间截断，不能据此判断编码
+        if sys.platform == 'win32' and not partial:
+            return data.decode('gbk', errors='replace')
+        return data.decode('utf-8', errors='replace')
+
+
+def utf8_boundary(data):
+    """去掉末尾不完整的UTF-8多字节字符后的长度"""
+    end = len(data)
+    # 最多回看3个字节，找到最后一个多字节字符的首字节
+    for i in range(end - 1, max(end - 4, -1), -1):
+        byte = data[i]
+        if byte < 0x80:
+            return end
+        if byte >= 0xC0:
+            length = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            return end if end - i >= length else i
+    return end
+
+
+def capture_command_output(cmd, echo=True):
+    """流式执行命令，内存中只保留头尾窗口；echo为True时输出同时实时写到终端"""
+    hasher = hashlib.sha256()
+    head = bytearray()
+    tail = bytearray()
+    total_bytes = 0
+
+    terminal = getattr(sys.stdout, 'buffer', None)
+    process = spill_file = spill_path = None
+    completed = False
+    try:
+        if OUTPUT_SPILL_DIR:
+            spill_dir = Path(OUTPUT_SPILL_DIR)
+            spill_dir.mkdir(parents=True, exist_ok=True)
+            spill_path = spill_dir / f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}.log.gz"
+            spill_file = gzip.open(spill_path, 'wb')
+
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=0,
+            creationflags=CREATE_NO_WINDOW if sys.platform == 'win32' else 0,
+            env=os.environ.copy()
+        )
+        while True:
+            chunk = process.stdout.read(64 * 1024)
+            if not chunk:
+                break
+            total_bytes += len(chunk)
+            hasher.update(chunk)
+            if spill_file:
+                spill_file.write(chunk)
+            if echo and terminal:
+                terminal.write(chunk)
+                terminal.flush()
+
+            if len(head) < OUTPUT_HEAD_BYTES:
+                take = OUTPUT_HEAD_BYTES - len(head)
+                head += chunk[:take]
+                chunk = chunk[take:]
+            if chunk:
+                tail += chunk
+                if len(tail) > OUTPUT_TAIL_BYTES:
+                    del tail[:len(tail) - OUTPUT_TAIL_BYTES]
+        completed = True
+    finally:
+        if process:
+            process.stdout.close()
+            process.wait()
+        if spill_file:
+            spill_file.close()
+        # 执行失败时不留下不完整的输出文件
+        if not completed and spill_path and spill_path.exists():
+            spill_path.unlink()
+
+    omitted = total_bytes - len(head) - len(tail)
+    if omitted > 0:
+        # 头部窗口可能在多字节字符中间截断，截到字符边界后再解码
+        head_end = utf8_boundary(head)
+        omitted += len(head) - head_end
+        text = (decode_output(bytes(head[:head_end])) + f"\n... [省略 {omitted} 字节] ...\n"
+                + decode_output(bytes(tail), partial=True))
+    else:
+        text = decode_output(bytes(head + tail))
+        # 输出未被截断，数据库中已有完整内容，无需保留文件
+        if spill_path:
+            spill_path.unlink()
+            spill_path = None
+
+    return CapturedOutput(text, total_bytes, hasher.hexdigest(), spill_path, process.returncode)
+
+
+# 终端样式
+STYLE_RESET = '\x1b[0m'
+STYLE_BOLD = '\x1b[1m'
+STYLE_DIM = '\x1b[2m'
+STYLE_HEADING = '\x1b[1;36m'
+STYLE_BULLET = '\x1b[33m'
+STYLE_INLINE_CODE = '\x1b[36m'
+STYLE_KEYWORD = '\x1b[35m'
+STYLE_STRING = '\x1b[32m'
+STYLE_COMMENT = '\x1b[90m'
+STYLE_NUMBER = '\x1b[33m'
+CLEAR_LINE = '\r\x1b[2K'
+
+# Markdown行级语法
+FENCE_PATTERN = re.compile(r'^\s*(```|~~~)\s*([\w+#.-]*)')
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.*)$')
+BULLET_PATTERN = re.compile(r'^(\s*)([-*+]|\d+[.)])(\s+)')
+INLINE_PATTERN = re.compile(r'`([^`]+)`|\*\*([^*]+)\*\*')
+
+# 代码块高亮：注释、字符串、数字和常见关键字（不区分语言）
+CODE_KEYWORDS = (
+    'and as async await break case catch class const continue def del do done elif else esac except export '
+    'false fi finally fn for from func function go if import in interface let local match new nil none not '
+    'null or package pass pub raise return self static struct switch then this throw true try type var while '
+    'with yield'
+)
+CODE_PATTERN = re.compile(
+    r'(?P<comment>#.*$|//.*$|--\s.*$)'
+    r'|(?P<string>"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')'
+    r'|(?P<number>\b\d+(?:\.\d+)?\b)'
+    r'|(?P<keyword>\b(?:' + '|'.join(CODE_KEYWORDS.split()) + r')\b)',
+    re.IGNORECASE
+)
+CODE_STYLES = {
+    'comment': STYLE_COMMENT,
+    'string': STYLE_STRING,
+    'number': STYLE_NUMBER,
+    'keyword': STYLE_KEYWORD,
+}
+
+
+def display_width(text):
+    """文本在终端中的显示宽度（中日韩全角字符占两列）"""
+    if text.isascii():
+        return len(text)
+    return sum(2 if unicodedata.east_asian_width(ch) in 'WF' else 1 for ch in text)
+
+
+def highlight_code(line):
+    """代码行高亮"""
+    return CODE_PATTERN.sub(lambda m: CODE_STYLES[m.lastgroup] + m.group(0) + STYLE_RESET, line)
+
+
+def style_inline(text):
+    """行内代码和粗体"""
+    def replace(match):
+        if match.group(1) is not None:
+            return STYLE_INLINE_CODE + match.group(1) + STYLE_RESET
+        return STYLE_BOLD + match.group(2) + STYLE_RESET
+    return INLINE_PATTERN.sub(replace, text)
+
+
+class StreamRenderer:
+    """流式Markdown渲染：未完成的行原样输出，行结束时只重绘这一行"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        if client_terminal_columns is not None:
+            self.enabled = True
+            self.columns = client_terminal_columns
+        else:
+            isatty = getattr(self.stream, 'isatty', None)
+            self.enabled = bool(isatty and isatty()) and 'NO_COLOR' not in os.environ
+            self.columns = shutil.get_terminal_size().columns
+        self.line = ''
+        self.in_code = False
+        # 最后输出的内容是否停在行中间
+        self.pending = False
+
+    def feed(self, text):
+        """写入一段流式文本"""
+        if not text:
+            return
+        self.pending = not text.endswith('\n')
+        if not self.enabled:
+            self.stream.write(text)
+            self.stream.flush()
+            return
+
+        parts = text.split('\n')
+        out = []
+        for part in parts[:-1]:
+            out.append(self._finish_line(part))
+            out.append('\n')
+        if parts[-1]:
+            self.line += parts[-1]
+            out.append(parts[-1])
+        self.stream.write(''.join(out))
+        self.stream.flush()
+
+    def close(self):
+        """结束输出，补齐最后一行"""
+        if self.pending:
+            if self.enabled:
+                self.stream.write(self._finish_line(''))
+            self.stream.write('\n')
+            self.pending = False
+        self.stream.flush()
+
+    def _finish_line(self, rest):
+        """当前行结束：返回需要写入的内容（重绘或剩余部分）"""
+        written = self.line
+        line = written + rest
+        self.line = ''
+        styled = self._style_line(line)
+        if styled == line:
+            return rest
+        # 已输出的部分折行后无法用回车重绘，只补齐剩余部分
+        if written and display_width(written) >= self.columns:
+            return rest
+        return (CLEAR_LINE if written else '') + styled
+
+    def _style_line(self, line):
+        """按Markdown语法为一整行添加样式"""
+        fence = FENCE_PATTERN.match(line)
+        if fence:
+            self.in_code = not self.in_code
+            return STYLE_DIM + line + STYLE_RESET
+        if self.in_code:
+            return highlight_code(line)
+        heading = HEADING_PATTERN.match(line)
+        if heading:
+            return STYLE_HEADING + line + STYLE_RESET
+        if line.startswith('>'):
+            return STYLE_DIM + line + STYLE_RESET
+        bullet = BULLET_PATTERN.match(line)
+        if bullet:
+            prefix = bullet.group(1) + STYLE_BULLET + bullet.group(2) + STYLE_RESET + bullet.group(3)
+            return prefix + style_inline(line[bullet.end():])
+        return style_inline(line)
+
+
+def stream_process_output(process):
+    """分块读取子进程输出，增量解码UTF-8后交给渲染器，返回完整文本"""
+    if process.stdout is None:
+        raise Exception("无法访问进程输出流")
+
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    renderer = StreamRenderer()
+    output = []
+    while True:
+        try:
+            # 无缓冲模式下read返回当前可读的数据，不会等满
+            chunk = process.stdout.read(4096)
+        except Exception as e:
+            print(f"读取错误: {str(e)}")
+            break
+        if not chunk:
+            break
+        text = decoder.decode(chunk)
+        if text:
+            renderer.feed(text)
+            output.append(text)
+    text = decoder.decode(b'', final=True)
+    if text:
+        renderer.feed(text)
+        output.append(text)
+    renderer.close()
+
+    process.wait()
+    return ''.join(output)
+
+
+# 以子进程方式运行aichat（原run_aichat_command实现）
+def run_aichat_subprocess(args, history_param=None):
+    """通过子进程运行aichat命令并捕获输出"""
+    global last_capture
     cmd = ["aichat"]
     
     # 检查是否是代码执行模式
@@ -326,17 +900,10 @@ def run_aichat_command(args, history_param=None):
                 actual_output = ""
                 if suggested_command:
                     try:
-                        # 执行实际命令并捕获输出
+                        # 执行实际命令，流式捕获输出（交互执行时已显示过输出，这里不再回显）
                         actual_cmd = ["bash", "-c", suggested_command]
-                        actual_process = subprocess.Popen(
-                            actual_cmd,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            text=True,
-                            encoding='utf-8'
-                        )
-                        stdout, stderr = actual_process.communicate()
-                        actual_output = stdout if stdout else stderr if stderr else ""
+                        last_capture = capture_command_output(actual_cmd, echo=False)
+                        actual_output = last_capture.text
                     except Exception as e:
                         actual_output = f"无法捕获命令执行结果: {str(e)}"
                 
@@ -363,14 +930,10 @@ def run_aichat_command(args, history_param=None):
                 actual_output = ""
                 if suggested_command:
                     try:
-                        # 执行实际命令并捕获输出
+                        # 执行实际命令，流式捕获输出（不再回显；解码时UTF-8失败回退到GBK）
                         actual_cmd = ["powershell", "-Command", "$OutputEncoding = [System.Text.Encoding]::UTF8; " + suggested_command]
-                        actual_output, _ = run_command(actual_cmd, capture_output=True, text=False)
-                        # 尝试使用UTF-8解码，如果失败则使用GBK解码（Windows中文系统默认）
-                        try:
-                            actual_output = actual_output.decode('utf-8')
-                        except UnicodeDecodeError:
-                            actual_output = actual_output.decode('gbk', errors='replace')
+                        last_capture = capture_command_output(actual_cmd, echo=False)
+                        actual_output = last_capture.text
                     except Exception as e:
                         actual_output = f"无法捕获命令执行结果: {str(e)}"
                 
@@ -378,9 +941,7 @@ def run_aichat_command(args, history_param=None):
                 complete_output = f"命令已执行: {suggested_command}\n\n{actual_output}"
                 return complete_output, suggested_command
         else:
-            # 非代码执行模式，优化为字符级流式输出
-            output = []
-            
+            # 非代码执行模式，流式输出
             if sys.platform != 'win32':
                 # Linux/Mac 流式输出处理
                 process = subprocess.Popen(
@@ -397,48 +958,8 @@ def run_aichat_command(args, history_param=None):
                 if process.stdout is None:
                     raise Exception("无法访问进程输出流")
                 
-                # 逐字符读取并实时打印
-                while True:
-                    try:
-                        char = process.stdout.read(1)  # 一次读取一个字节
-                        if not char:  # 结束标志
-                            break
-                        
-                        # 尝试解码字符
-                        decoded_char = char.decode('utf-8')
-                        sys.stdout.write(decoded_char)  # 直接写入标准输出
-                        sys.stdout.flush()  # 立即刷新输出
-                        output.append(decoded_char)
-                    except UnicodeDecodeError:
-                        # 可能是多字节字符的一部分，继续读取
-                        buffer = char
-                        while True:
-                            try:
-                                decoded_char = buffer.decode('utf-8')
-                                sys.stdout.write(decoded_char)
-                                sys.stdout.flush()
-                                output.append(decoded_char)
-                                break
-                            except UnicodeDecodeError:
-                                next_char = process.stdout.read(1)
-                                if not next_char:  # 到达流末尾
-                                    # 处理不完整的多字节字符
-                                    try:
-                                        decoded_char = buffer.decode('utf-8', errors='replace')
-                                        sys.stdout.write(decoded_char)
-                                        sys.stdout.flush()
-                                        output.append(decoded_char)
-                                    except:
-                                        pass
-                                    break
-                                buffer += next_char
-                    except Exception as e:
-                        # 捕获其他读取错误
-                        print(f"读取错误: {str(e)}")
-                        break
-                
-                process.wait()
-                final_output = ''.join(output)
+                # 分块读取并实时渲染
+                final_output = stream_process_output(process)
                 return final_output.strip(), None
             else:
                 # Windows 流式输出处理
@@ -459,49 +980,8 @@ def run_aichat_command(args, history_param=None):
                     if process.stdout is None:
                         raise Exception("无法访问进程输出流")
                         
-                    # 逐字符读取并实时打印
-                    while True:
-                        try:
-                            char = process.stdout.read(1)  # 一次读取一个字节
-                            if not char:  # 结束标志
-                                break
-                            
-                            # 尝试用UTF-8解码
-                            decoded_char = char.decode('utf-8')
-                            sys.stdout.write(decoded_char)
-                            sys.stdout.flush()
-                            output.append(decoded_char)
-                        except UnicodeDecodeError:
-                            # 可能是多字节字符的一部分，继续读取
-                            buffer = char
-                            while True:
-                                try:
-                                    # 尝试解码
-                                    decoded_char = buffer.decode('utf-8')
-                                    sys.stdout.write(decoded_char)
-                                    sys.stdout.flush()
-                                    output.append(decoded_char)
-                                    break
-                                except UnicodeDecodeError:
-                                    next_char = process.stdout.read(1)
-                                    if not next_char:  # 到达流末尾
-                                        # 处理不完整的多字节字符
-                                        try:
-                                            decoded_char = buffer.decode('utf-8', errors='replace')
-                                            sys.stdout.write(decoded_char)
-                                            sys.stdout.flush()
-                                            output.append(decoded_char)
-                                        except:
-                                            pass
-                                        break
-                                    buffer += next_char
-                        except Exception as e:
-                            # 捕获其他读取错误
-                            print(f"读取错误: {str(e)}")
-                            break
-                    
-                    process.wait()
-                    final_output = ''.join(output)
+                    # 分块读取并实时渲染
+                    final_output = stream_process_output(process)
                     return final_output.strip(), None
                 except Exception as e:
                     error_msg = f"字符级流式输出失败: {str(e)}"
@@ -529,8 +1009,229 @@ def run_aichat_command(args, history_param=None):
                     final_output = ''.join(output)
                     return final_output.strip(), None
     except Exception as e:
-        return f"错误: 无法执行aichat命令 - {str(e)}", None
+        error_msg = f"错误: 无法执行aichat命令 - {str(e)}"
+        print(error_msg)
+        return error_msg, None
     
+class AichatBackend(abc.ABC):
+    """aichat后端接口"""
+    name = ''
+    # 代码执行模式依赖aichat的交互菜单，只有子进程后端支持
+    supports_code_mode = False
+
+    @abc.abstractmethod
+    def run(self, args, history_param=None):
+        """发送请求并流式输出，返回 (输出, 建议的命令)"""
+
+    def warm(self):
+        """预热后端（如提前建立连接），默认无操作"""
+        pass
+
+
+class SubprocessBackend(AichatBackend):
+    """通过子进程调用aichat可执行文件"""
+    name = 'aichat'
+    supports_code_mode = True
+
+    def run(self, args, history_param=None):
+        return run_aichat_subprocess(args, history_param)
+
+
+class HTTPConnectionPool:
+    """按 (scheme, host, port) 复用的keep-alive连接池"""
+
+    def __init__(self, max_idle=4, timeout=API_TIMEOUT):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = {}
+
+    def get(self, scheme, host, port):
+        """取出一个空闲连接，没有则新建"""
+        idle = self._idle.get((scheme, host, port))
+        if idle:
+            return idle.pop()
+        # http.client导入较慢，只在实际发起请求时导入，转发给常驻进程的客户端无需加载
+        import http.client
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def put(self, scheme, host, port, connection):
+        """归还连接，池满时直接关闭"""
+        idle = self._idle.setdefault((scheme, host, port), [])
+        if len(idle) < self.max_idle:
+            idle.append(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        """关闭所有空闲连接"""
+        for idle in self._idle.values():
+            for connection in idle:
+                connection.close()
+        self._idle.clear()
+
+
+def split_aichat_args(args):
+    """从aichat参数中拆出角色和消息"""
+    role = None
+    words = []
+    i = 0
+    while i < len(args):
+        if args[i] == '-r' and i + 1 < len(args):
+            role = args[i + 1]
+            i += 2
+            continue
+        if args[i] != '-e':
+            words.append(args[i])
+        i += 1
+    return role, ' '.join(words)
+
+
+def build_chat_messages(message, history_param=None, role=None):
+    """将消息和历史记录参数转换为OpenAI格式的messages"""
+    messages = []
+    if role:
+        messages.append({"role": "system", "content": f"你现在的角色是: {role}"})
+    if history_param:
+        # 历史记录中最后一项是当前问题
+        for item in history_param[:-1]:
+            messages.append({"role": "user", "content": item["problem"]})
+            if item.get("output"):
+                messages.append({"role": "assistant", "content": item["output"]})
+        messages.append({"role": "user", "content": history_param[-1]["problem"]})
+    else:
+        messages.append({"role": "user", "content": message})
+    return messages
+
+
+class OpenAIBackend(AichatBackend):
+    """进程内的OpenAI兼容接口客户端，流式解析SSE并复用连接"""
+    name = 'openai'
+
+    def __init__(self, base_url=API_BASE_URL, api_key=API_KEY, model=API_MODEL, pool=None):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme or 'http'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.scheme == 'https' else 80)
+        self.path = parts.path.rstrip('/') + '/chat/completions'
+        self.api_key = api_key
+        self.model = model
+        self.pool = pool or HTTPConnectionPool()
+
+    def warm(self):
+        """提前完成TCP/TLS握手并放回连接池"""
+        connection = self.pool.get(self.scheme, self.host, self.port)
+        try:
+            connection.connect()
+        except OSError:
+            connection.close()
+            return
+        self.pool.put(self.scheme, self.host, self.port, connection)
+
+    def _request(self, body):
+        """发送请求，复用的连接失效时用新连接重试一次"""
+        headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        import http.client
+        for attempt in range(2):
+            connection = self.pool.get(self.scheme, self.host, self.port)
+            try:
+                connection.request("POST", self.path, body=body, headers=headers)
+                return connection, connection.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                if attempt:
+                    raise
+
+    def run(self, args, history_param=None):
+        role, message = split_aichat_args(args)
+        body = json.dumps({
+            "model": self.model,
+            "messages": build_chat_messages(message, history_param, role),
+            "stream": True,
+        }).encode('utf-8')
+
+        try:
+            connection, response = self._request(body)
+        except Exception as e:
+            error_msg = f"错误: 无法连接接口 {self.host}:{self.port} - {str(e)}"
+            print(error_msg)
+            return error_msg, None
+
+        if response.status != 200:
+            detail = response.read().decode('utf-8', errors='replace')
+            connection.close()
+            error_msg = f"错误: 接口返回状态码 {response.status} - {detail[:200]}"
+            print(error_msg)
+            return error_msg, None
+
+        output = []
+        renderer = StreamRenderer()
+        try:
+            for raw_line in iter(response.readline, b''):
+                line = raw_line.decode('utf-8').strip()
+                if not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                choices = json.loads(data).get('choices') or [{}]
+                text = (choices[0].get('delta') or {}).get('content')
+                if text:
+                    renderer.feed(text)
+                    output.append(text)
+            # 读完剩余内容，连接才能复用
+            response.read()
+        except Exception as e:
+            connection.close()
+            renderer.close()
+            print(f"读取错误: {str(e)}")
+            return ''.join(output).strip(), None
+        renderer.close()
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.put(self.scheme, self.host, self.port, connection)
+        return ''.join(output).strip(), None
+
+
+# 已创建的后端实例，连接池在同一进程内复用
+_backends = {}
+
+
+def get_backend(name=None):
+    """按名称获取后端实例"""
+    name = name or BACKEND_NAME
+    if name not in _backends:
+        if name == 'openai':
+            _backends[name] = OpenAIBackend()
+        elif name == 'aichat':
+            _backends[name] = SubprocessBackend()
+        else:
+            raise ValueError(f"未知的后端: {name}")
+    return _backends[name]
+
+
+def run_aichat_command(args, history_param=None):
+    """运行aichat命令并捕获输出"""
+    global last_capture
+    last_capture = None
+    try:
+        backend = get_backend()
+    except ValueError as e:
+        error_msg = f"错误: {str(e)}"
+        print(error_msg)
+        return error_msg, None
+
+    # 代码执行模式回退到子进程后端
+    if '-e' in args and not backend.supports_code_mode:
+        backend = get_backend('aichat')
+    return backend.run(args, history_param)
+
+
 def extract_answer_from_output(output, is_code_mode=False):
     """从输出中提取答案部分"""
     if is_code_mode and "?" in output and "execute | revise | describe | copy | quit" in output:
@@ -593,15 +1294,754 @@ def create_param_list(records):
         param_list.append(item)
     return param_list
 
-# 修改main函数
-def main():
-    global conn
-    
-    # 初始化数据库连接
+# 同步的表：chat_history以uuid标识，sessions以session_id标识，session_messages以两者组合标识
+SYNC_TABLES = ['chat_history', 'sessions', 'session_messages']
+
+# 本数据库的来源ID
+_origin_id = None
+
+
+def get_origin_id(cursor):
+    """获取本数据库的来源ID，首次使用时生成"""
+    global _origin_id
+    if _origin_id is None:
+        cursor.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('origin_id', ?)", (str(uuid.uuid4()),))
+        cursor.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('seq', '0')")
+        cursor.execute("SELECT value FROM sync_state WHERE key = 'origin_id'")
+        _origin_id = cursor.fetchone()[0]
+    return _origin_id
+
+
+def next_change(cursor):
+    """为一条本地变更分配 (来源ID, 单调递增序号)"""
+    origin_id = get_origin_id(cursor)
+    cursor.execute("UPDATE sync_state SET value = CAST(value AS INTEGER) + 1 WHERE key = 'seq'")
+    cursor.execute("SELECT CAST(value AS INTEGER) FROM sync_state WHERE key = 'seq'")
+    return origin_id, cursor.fetchone()[0]
+
+
+def stamp_unsynced_rows(cursor):
+    """为启用同步前（或旧版本写入）的记录补充来源ID和序号"""
+    for table in SYNC_TABLES:
+        cursor.execute(f"SELECT id FROM {table} WHERE origin_id IS NULL ORDER BY id")
+        for (row_id,) in cursor.fetchall():
+            cursor.execute(f"UPDATE {table} SET origin_id = ?, seq = ? WHERE id = ?", next_change(cursor) + (row_id,))
+    cursor.execute("SELECT id FROM chat_history WHERE uuid IS NULL")
+    for (row_id,) in cursor.fetchall():
+        cursor.execute("UPDATE chat_history SET uuid = ? WHERE id = ?", (str(uuid.uuid4()), row_id))
+    conn.commit()
+
+
+def get_sync_vector(cursor):
+    """本地已有变更的版本向量：{来源ID: 最大序号}"""
+    vector = {}
+    for table in SYNC_TABLES:
+        cursor.execute(f"SELECT origin_id, MAX(seq) FROM {table} WHERE origin_id IS NOT NULL GROUP BY origin_id")
+        for origin_id, seq in cursor.fetchall():
+            vector[origin_id] = max(vector.get(origin_id, 0), seq)
+    return vector
+
+
+def export_changes(cursor, vector, origins=None):
+    """导出版本向量之后的变更，origins限定只导出哪些来源"""
+    if origins is None:
+        origins = list(get_sync_vector(cursor))
+    changes = {"chats": [], "sessions": [], "members": []}
+    for origin_id in origins:
+        since = vector.get(origin_id, 0)
+        cursor.execute("""
+            SELECT uuid, timestamp, problem, answer, output, role, output_bytes, output_sha256, origin_id, seq
+            FROM chat_history WHERE origin_id = ? AND seq > ? ORDER BY seq
+        """, (origin_id, since))
+        changes["chats"].extend(cursor.fetchall())
+        cursor.execute("""
+            SELECT session_id, start_time, origin_id, seq
+            FROM sessions WHERE origin_id = ? AND seq > ? ORDER BY seq
+        """, (origin_id, since))
+        changes["sessions"].extend(cursor.fetchall())
+        cursor.execute("""
+            SELECT s.session_id, ch.uuid, sm.origin_id, sm.seq FROM session_messages sm
+            JOIN sessions s ON s.id = sm.session_id
+            JOIN chat_history ch ON ch.id = sm.message_id
+            WHERE sm.origin_id = ? AND sm.seq > ? ORDER BY sm.seq
+        """, (origin_id, since))
+        changes["members"].extend(cursor.fetchall())
+    return changes
+
+
+def count_changes(changes):
+    """变更条数"""
+    return sum(len(rows) for rows in changes.values())
+
+
+def import_changes(cursor, changes):
+    """合并远端变更：按uuid去重，会话成员取并集，返回新增条数；数据有误时整体回滚"""
+    try:
+        imported = merge_changes(cursor, changes)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return imported
+
+
+def merge_changes(cursor, changes):
+    """在当前事务中写入远端变更，返回新增条数"""
+    imported = 0
+    for row in changes.get("chats", []):
+        cursor.execute("SELECT 1 FROM chat_history WHERE uuid = ?", (row[0],))
+        if not cursor.fetchone():
+            cursor.execute(
+                "INSERT INTO chat_history (uuid, timestamp, problem, answer, output, role, output_bytes, output_sha256, origin_id, seq) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row
+            )
+            imported += 1
+    for row in changes.get("sessions", []):
+        cursor.execute("SELECT 1 FROM sessions WHERE session_id = ?", (row[0],))
+        if not cursor.fetchone():
+            # 远端会话只作为历史导入，不影响本地的活跃会话
+            cursor.execute(
+                "INSERT INTO sessions (session_id, start_time, is_active, origin_id, seq) VALUES (?, ?, 0, ?, ?)",
+                row
+            )
+            imported += 1
+    for session_uuid, message_uuid, origin_id, seq in changes.get("members", []):
+        cursor.execute("SELECT id FROM sessions WHERE session_id = ?", (session_uuid,))
+        session_row = cursor.fetchone()
+        cursor.execute("SELECT id FROM chat_history WHERE uuid = ?", (message_uuid,))
+        message_row = cursor.fetchone()
+        if not session_row or not message_row:
+            continue
+        cursor.execute("SELECT 1 FROM session_messages WHERE session_id = ? AND message_id = ?",
+                       (session_row[0], message_row[0]))
+        if not cursor.fetchone():
+            cursor.execute(
+                "INSERT INTO session_messages (session_id, message_id, origin_id, seq) VALUES (?, ?, ?, ?)",
+                (session_row[0], message_row[0], origin_id, seq)
+            )
+            imported += 1
+    return imported
+
+
+def pack_changes(payload):
+    """将同步数据序列化并压缩"""
+    return gzip.compress(json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+
+
+def unpack_changes(data):
+    """解压并反序列化同步数据，解压后超过大小上限时拒绝"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        raw = decompressor.decompress(data, SYNC_MAX_PAYLOAD_BYTES)
+    except zlib.error as e:
+        raise ValueError(f"同步数据不是有效的gzip格式: {str(e)}") from e
+    if decompressor.unconsumed_tail:
+        raise ValueError(f"同步数据解压后超过 {SYNC_MAX_PAYLOAD_BYTES} 字节")
+    if not decompressor.eof:
+        raise ValueError("同步数据不完整")
+    return json.loads(raw.decode('utf-8'))
+
+
+def sync_push_dir(cursor, directory):
+    """将本地新变更写入共享目录，每次生成一个批次文件"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    stamp_unsynced_rows(cursor)
+    origin_id = get_origin_id(cursor)
+    peer = f"file:{directory.resolve()}"
+
+    cursor.execute("SELECT last_seq FROM sync_peers WHERE peer = ? AND origin_id = ?", (peer, origin_id))
+    row = cursor.fetchone()
+    since = row[0] if row else 0
+    changes = export_changes(cursor, {origin_id: since}, [origin_id])
+    if not count_changes(changes):
+        print("没有新的变更需要推送")
+        return
+
+    last_seq = max(row[-1] for rows in changes.values() for row in rows)
+    data = pack_changes(changes)
+    batch_path = directory / f"{origin_id}-{since + 1:010d}-{last_seq:010d}.json.gz"
+    # 先写临时文件再重命名，避免其他主机读到不完整的批次
+    temp_path = batch_path.with_suffix('.tmp')
+    temp_path.write_bytes(data)
+    os.replace(temp_path, batch_path)
+
+    cursor.execute(
+        "INSERT INTO sync_peers (peer, origin_id, last_seq) VALUES (?, ?, ?) "
+        "ON CONFLICT (peer, origin_id) DO UPDATE SET last_seq = excluded.last_seq",
+        (peer, origin_id, last_seq)
+    )
+    conn.commit()
+    print(f"已推送 {count_changes(changes)} 条变更到 {batch_path.name}（{len(data)} 字节）")
+
+
+def sync_pull_dir(cursor, directory):
+    """从共享目录读取其他主机的批次文件并合并"""
+    stamp_unsynced_rows(cursor)
+    origin_id = get_origin_id(cursor)
+    vector = get_sync_vector(cursor)
+
+    batches = []
+    for path in Path(directory).glob("*.json.gz"):
+        try:
+            batch_origin, first_seq, last_seq = path.name[:-len(".json.gz")].rsplit('-', 2)
+            first_seq, last_seq = int(first_seq), int(last_seq)
+        except ValueError:
+            continue
+        if batch_origin != origin_id and last_seq > vector.get(batch_origin, 0):
+            batches.append((batch_origin, first_seq, path))
+
+    imported = total_bytes = 0
+    failed_origins = set()
+    for batch_origin, _, path in sorted(batches):
+        # 同一来源的批次必须按序合并：前面的批次失败后，后面的批次会让版本向量越过缺口，
+        # 失败的批次以后再也不会被选中，因此留到下次拉取时一起重试
+        if batch_origin in failed_origins:
+            continue
+        try:
+            data = path.read_bytes()
+            imported += import_changes(cursor, unpack_changes(data))
+        except SYNC_ERRORS as e:
+            print(f"跳过无法读取的批次 {path.name} 及该来源的后续批次: {str(e)}")
+            failed_origins.add(batch_origin)
+            continue
+        total_bytes += len(data)
+    print(f"已读取 {len(batches)} 个批次（{total_bytes} 字节），合并 {imported} 条变更")
+
+
+def send_frame(sock, payload):
+    """发送一帧：4字节长度 + 压缩的JSON"""
+    data = pack_changes(payload)
+    sock.sendall(struct.pack('>I', len(data)) + data)
+    return len(data)
+
+
+def recv_exact(sock, size):
+    """从套接字读取指定字节数"""
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 64 * 1024))
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        data += chunk
+    return bytes(data)
+
+
+def recv_frame(sock):
+    """接收一帧"""
+    (length,) = struct.unpack('>I', recv_exact(sock, 4))
+    if length > SYNC_MAX_FRAME_BYTES:
+        raise ValueError(f"同步数据帧过大: {length} 字节")
+    return unpack_changes(recv_exact(sock, length))
+
+
+def parse_sync_address(address):
+    """解析 host:port，省略host时使用本机"""
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def is_loopback_host(host):
+    """监听地址是否只限本机"""
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        pass
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except OSError:
+        return False
+    return all(ipaddress.ip_address(info[4][0]).is_loopback for info in infos)
+
+
+def check_sync_token(token):
+    """校验客户端令牌（未配置令牌时不校验）"""
+    if not SYNC_TOKEN:
+        return True
+    return hmac.compare_digest(str(token or '').encode('utf-8'), SYNC_TOKEN.encode('utf-8'))
+
+
+def sync_serve(cursor, address):
+    """作为同步服务端等待其他主机连接，每次连接双向交换变更"""
+    try:
+        host, port = parse_sync_address(address)
+    except ValueError:
+        print(f"错误：无效的同步地址 '{address}'")
+        return
+    # 未设置令牌时，任何能连上的主机都能读取和写入全部记录，只允许监听本机
+    if not SYNC_TOKEN and not is_loopback_host(host):
+        print(f"错误：监听非本机地址 {host} 时必须设置 AI_SYNC_TOKEN")
+        return
+    try:
+        server = socket.create_server((host, port))
+    except OSError as e:
+        print(f"错误：无法启动同步服务 - {str(e)}")
+        return
+    print(f"同步服务已启动: {address}")
+    try:
+        while True:
+            client, peer_address = server.accept()
+            with client:
+                client.settimeout(API_TIMEOUT)
+                try:
+                    request = recv_frame(client)
+                    if not check_sync_token(request.get("token")):
+                        print(f"拒绝未授权的同步请求: {peer_address[0]}")
+                        continue
+                    stamp_unsynced_rows(cursor)
+                    changes = export_changes(cursor, request.get("vector", {}))
+                    sent = send_frame(client, {"vector": get_sync_vector(cursor), "changes": changes})
+                    received = recv_frame(client)
+                    imported = import_changes(cursor, received.get("changes", {}))
+                    print(f"{peer_address[0]}: 发送 {count_changes(changes)} 条（{sent} 字节），合并 {imported} 条")
+                except SYNC_ERRORS as e:
+                    print(f"同步失败: {peer_address[0]} - {str(e)}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+def sync_with(cursor, address):
+    """连接同步服务端，双向交换变更"""
+    stamp_unsynced_rows(cursor)
+    try:
+        with socket.create_connection(parse_sync_address(address), timeout=API_TIMEOUT) as sock:
+            send_frame(sock, {"token": SYNC_TOKEN, "vector": get_sync_vector(cursor)})
+            response = recv_frame(sock)
+            imported = import_changes(cursor, response.get("changes", {}))
+            changes = export_changes(cursor, response.get("vector", {}))
+            sent = send_frame(sock, {"changes": changes})
+    except ConnectionError as e:
+        print(f"错误：同步失败 - {str(e)}（服务端未运行，或 AI_SYNC_TOKEN 与服务端不一致）")
+        return
+    except SYNC_ERRORS as e:
+        print(f"错误：同步失败 - {str(e)}")
+        return
+    print(f"合并 {imported} 条变更，发送 {count_changes(changes)} 条（{sent} 字节）")
+
+
+def create_problem_list(records):
+    """根据记录创建只包含问题的参数列表（不携带输出，上下文更小）"""
+    return [{"problem": item["problem"]} for item in create_param_list(records)]
+
+
+# 历史上下文的格式：full携带问题和输出，problems只携带问题
+CONTEXT_FORMATTERS = {
+    'full': create_param_list,
+    'problems': create_problem_list,
+}
+
+# 内置的角色模板：默认角色要求用中文回答，代码执行和自定义角色不做修饰
+DEFAULT_PROMPT_TEMPLATES = {
+    'default': {'language': 'Chinese'},
+}
+
+# 自定义模板文件（JSON，按角色名配置 prefix/suffix/language/context，覆盖内置模板）
+PROMPT_TEMPLATES_PATH = Path(os.environ.get('AI_TEMPLATES_PATH', DB_PATH.parent / "ai_templates.json"))
+
+# 行内（两侧都是非空白字符）的连续空白，以及行尾空白；行首缩进不在其中
+INNER_WHITESPACE_PATTERN = re.compile(r'(?<=\S)[ \t\u3000]+(?=\S)')
+TRAILING_WHITESPACE_PATTERN = re.compile(r'[ \t\u3000]+$', re.MULTILINE)
+
+
+def normalize_prompt(text):
+    """规范化问题文本：合并行内连续空白，去掉行尾空白、首尾空行和公共缩进，保留相对缩进"""
+    text = TRAILING_WHITESPACE_PATTERN.sub('', text)
+    text = INNER_WHITESPACE_PATTERN.sub(' ', text)
+    return textwrap.dedent(text).strip('\n')
+
+
+class PromptTemplate:
+    """角色的提示词模板：前缀、后缀、回答语言和历史上下文格式"""
+
+    def __init__(self, prefix='', suffix='', language='', context='full'):
+        if context not in CONTEXT_FORMATTERS:
+            raise ValueError(f"未知的上下文格式: {context}")
+        # 前后缀在创建时一次性拼好，渲染时只做字符串拼接
+        self.before = prefix
+        self.after = suffix + (f"; answer by {language}" if language else '')
+        self.format_context = CONTEXT_FORMATTERS[context]
+
+    def render(self, message):
+        """生成发送给AI的问题"""
+        return self.before + normalize_prompt(message) + self.after
+
+
+@functools.lru_cache(maxsize=1)
+def load_prompt_templates():
+    """读取内置模板和自定义模板文件"""
+    templates = {role: dict(config) for role, config in DEFAULT_PROMPT_TEMPLATES.items()}
+    if PROMPT_TEMPLATES_PATH.exists():
+        try:
+            with open(PROMPT_TEMPLATES_PATH, 'r', encoding='utf-8') as f:
+                for role, config in json.load(f).items():
+                    templates[role] = config
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"模板文件读取失败，使用内置模板: {str(e)}")
+    return templates
+
+
+@functools.lru_cache(maxsize=None)
+def get_prompt_template(role):
+    """获取角色的模板（编译后缓存）"""
+    try:
+        return PromptTemplate(**load_prompt_templates().get(role, {}))
+    except (TypeError, ValueError) as e:
+        print(f"角色 {role} 的模板配置无效，不做修饰: {str(e)}")
+        return PromptTemplate()
+
+
+def ask(cursor, args, role, message, records=None):
+    """按角色模板生成问题，调用aichat并保存记录；records为携带的历史记录"""
+    template = get_prompt_template(role)
+    prompt = template.render(message)
+
+    cmd_args = []
+    if args.e:
+        cmd_args.append('-e')
+    if records is None:
+        if args.r:
+            cmd_args.extend(['-r', args.r])
+        cmd_args.append(prompt)
+        param_list = None
+        context_bytes = 0
+    else:
+        # 携带历史记录时，当前问题作为参数列表的最后一项
+        param_list = template.format_context(records)
+        context_bytes = check_context_budget(param_list)
+        param_list.append({"problem": prompt})
+
+    output, suggested_cmd = run_aichat_command(cmd_args, param_list)
+
+    # 代码执行模式下，使用捕获的命令建议作为答案
+    if args.e and suggested_cmd:
+        answer = suggested_cmd
+    else:
+        answer = extract_answer_from_output(output, args.e)
+
+    # 保存规范化后的原始问题，而不是添加了提示的问题
+    sent = prompt if param_list is None else json.dumps(param_list, ensure_ascii=False)
+    save_chat_record(cursor, normalize_prompt(message), answer, output, role, capture=last_capture,
+                     prompt=sent, context_bytes=context_bytes)
+
+
+# 预先读取的活跃会话消息：(缓存键, 记录列表)
+_context_cache = None
+
+
+def get_session_records(cursor):
+    """获取活跃会话的所有消息，会话消息未变化时直接使用缓存"""
+    global _context_cache
+    cursor.execute("""
+        SELECT s.id, COUNT(sm.id), MAX(sm.message_id) FROM sessions s
+        LEFT JOIN session_messages sm ON sm.session_id = s.id
+        WHERE s.is_active = 1 GROUP BY s.id ORDER BY s.id DESC LIMIT 1
+    """)
+    key = cursor.fetchone()
+    if _context_cache is None or _context_cache[0] != key:
+        _context_cache = (key, get_active_session_messages(cursor) if key else [])
+    return _context_cache[1]
+
+
+def warm_prefetch_state():
+    """预热：打开数据库、构建会话上下文、建立后端连接"""
     cursor = init_db_connection()
-    
-    # 初始化数据库
     init_db(cursor)
+    get_session_records(cursor)
+    try:
+        get_backend().warm()
+    except ValueError:
+        pass
+
+
+def read_prefetch_marker():
+    """Windows下读取预热进程的端口和令牌"""
+    try:
+        port, token = PREFETCH_SOCKET.read_text(encoding='utf-8').split()
+        return int(port), token
+    except (OSError, ValueError):
+        return None, None
+
+
+def is_private_path(path, directory=False):
+    """POSIX下检查路径属于当前用户且不是符号链接，目录还要求其他用户不可访问"""
+    if sys.platform == 'win32':
+        return True
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if st.st_uid != os.getuid() or stat.S_ISLNK(st.st_mode):
+        return False
+    return not directory or (stat.S_ISDIR(st.st_mode) and st.st_mode & 0o077 == 0)
+
+
+def ensure_prefetch_dir():
+    """创建仅当前用户可访问的套接字目录，目录不安全时返回False"""
+    if sys.platform != 'win32':
+        PREFETCH_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if not is_private_path(PREFETCH_DIR, directory=True):
+        print(f"错误: 目录 {PREFETCH_DIR} 不属于当前用户或权限过宽，无法启动预热进程", file=sys.stderr)
+        return False
+    return True
+
+
+def connect_prefetch_server(timeout=0.5):
+    """连接常驻预热进程，返回 (套接字, 令牌)，未运行时返回 (None, None)"""
+    if not PREFETCH_SOCKET.exists():
+        return None, None
+    # 只连接当前用户私有目录中、属于当前用户的套接字，防止其他用户抢先创建
+    if not is_private_path(PREFETCH_DIR, directory=True) or not is_private_path(PREFETCH_SOCKET):
+        return None, None
+    try:
+        if sys.platform == 'win32':
+            port, token = read_prefetch_marker()
+            if port is None:
+                return None, None
+            sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+        else:
+            token = ''
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(str(PREFETCH_SOCKET))
+    except OSError:
+        return None, None
+    sock.settimeout(None)
+    return sock, token
+
+
+# 预热进程返回给客户端的帧类型：标准输出、标准错误、退出码、拒绝执行（客户端改为本地执行）
+FRAME_STDOUT = b'o'
+FRAME_STDERR = b'e'
+FRAME_EXIT = b'x'
+FRAME_REFUSED = b'r'
+
+# 影响请求执行的环境变量前缀（数据库路径、后端、接口、价格和预算等），常驻进程与客户端不一致时不转发
+PREFETCH_ENV_PREFIXES = ('AI_', 'OPENAI_')
+
+
+def prefetch_environment():
+    """当前进程中影响请求执行的环境变量（预热进程自身的配置除外）"""
+    return {key: value for key, value in os.environ.items()
+            if key.startswith(PREFETCH_ENV_PREFIXES) and not key.startswith('AI_PREFETCH_')}
+
+
+class FrameWriter(io.RawIOBase):
+    """将写入的数据按帧（1字节类型 + 4字节长度 + 数据）发送给客户端"""
+
+    def __init__(self, sock, kind):
+        self.sock = sock
+        self.kind = kind
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.sock.sendall(self.kind + struct.pack('>I', len(data)) + bytes(data))
+        return len(data)
+
+
+def write_client_stream(stream, data):
+    """把预热进程返回的数据写到本地标准输出或标准错误"""
+    buffer = getattr(stream, 'buffer', None)
+    if buffer:
+        buffer.write(data)
+        buffer.flush()
+    else:
+        stream.write(data.decode('utf-8', errors='replace'))
+        stream.flush()
+
+
+def forward_to_prefetch_server(argv):
+    """将请求交给常驻预热进程执行并转发输出，返回退出码；进程未运行时返回None"""
+    sock, token = connect_prefetch_server()
+    if not sock:
+        return None
+    columns = shutil.get_terminal_size().columns if sys.stdout.isatty() and 'NO_COLOR' not in os.environ else None
+    request = {"op": "run", "token": token, "argv": argv, "cwd": os.getcwd(), "columns": columns,
+               "env": prefetch_environment()}
+    try:
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        while True:
+            kind, length = struct.unpack('>cI', recv_exact(sock, 5))
+            data = recv_exact(sock, length)
+            if kind == FRAME_REFUSED:
+                return None
+            if kind == FRAME_EXIT:
+                return int(data)
+            write_client_stream(sys.stderr if kind == FRAME_STDERR else sys.stdout, data)
+    except (OSError, ValueError) as e:
+        print(f"预热进程通信失败: {str(e)}", file=sys.stderr)
+        return 1
+    finally:
+        sock.close()
+
+
+def start_prefetch():
+    """通知常驻进程预热，未运行时在后台启动它"""
+    sock, token = connect_prefetch_server()
+    if sock:
+        try:
+            sock.sendall(json.dumps({"op": "warm", "token": token}).encode('utf-8') + b'\n')
+        finally:
+            sock.close()
+        return
+
+    if getattr(sys, 'frozen', False):
+        cmd = [sys.executable, '--serve']
+    else:
+        cmd = [sys.executable, str(Path(__file__).resolve()), '--serve']
+    options = {}
+    if sys.platform == 'win32':
+        options['creationflags'] = subprocess.DETACHED_PROCESS | CREATE_NO_WINDOW
+    else:
+        options['start_new_session'] = True
+    subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, env=os.environ.copy(), **options)
+
+
+def handle_prefetch_request(client, token):
+    """处理一次预热进程请求：warm 预热，run 执行命令并把输出写回客户端"""
+    reader = client.makefile('rb')
+    line = reader.readline()
+    reader.close()
+    try:
+        request = json.loads(line)
+    except ValueError:
+        return
+    if request.get("token", '') != token:
+        return
+
+    if request.get("op") == "run" and request.get("env") != prefetch_environment():
+        # 常驻进程使用启动时的配置，客户端改了数据库、后端等设置时由客户端自己执行
+        try:
+            client.sendall(FRAME_REFUSED + struct.pack('>I', 0))
+        except OSError:
+            pass
+    elif request.get("op") == "run":
+        global client_terminal_columns
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = io.TextIOWrapper(io.BufferedWriter(FrameWriter(client, FRAME_STDOUT)),
+                                      encoding='utf-8', write_through=True)
+        sys.stderr = io.TextIOWrapper(io.BufferedWriter(FrameWriter(client, FRAME_STDERR)),
+                                      encoding='utf-8', write_through=True)
+        client_terminal_columns = request.get("columns")
+        status = 0
+        try:
+            os.chdir(request.get("cwd") or os.getcwd())
+            main(request.get("argv", []))
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                status = e.code
+            elif e.code is not None:
+                print(e.code, file=sys.stderr)
+                status = 1
+        except Exception as e:
+            print(f"错误: 预热进程执行失败 - {str(e)}", file=sys.stderr)
+            status = 1
+        finally:
+            # 常驻连接不能留下未结束的写事务，否则其他进程无法写入数据库
+            if conn:
+                if status == 0:
+                    conn.commit()
+                else:
+                    conn.rollback()
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                client.sendall(FRAME_EXIT + struct.pack('>I', len(str(status))) + str(status).encode('ascii'))
+            except OSError:
+                pass
+            sys.stdout, sys.stderr = stdout, stderr
+            client_terminal_columns = None
+
+    # 为下一次请求提前准备好上下文和连接
+    warm_prefetch_state()
+
+
+def serve_prefetch():
+    """运行常驻预热进程，空闲超时后自动退出"""
+    global RESIDENT
+    if not ensure_prefetch_dir():
+        return
+    RESIDENT = True
+    warm_prefetch_state()
+
+    token = ''
+    if sys.platform == 'win32':
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        token = secrets.token_hex(16)
+        PREFETCH_SOCKET.write_text(f"{server.getsockname()[1]} {token}", encoding='utf-8')
+    else:
+        if PREFETCH_SOCKET.exists():
+            PREFETCH_SOCKET.unlink()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # 在umask下绑定，套接字创建时即只有当前用户可访问
+        old_umask = os.umask(0o077)
+        try:
+            server.bind(str(PREFETCH_SOCKET))
+        finally:
+            os.umask(old_umask)
+    server.listen(4)
+    server.settimeout(PREFETCH_IDLE_TIMEOUT)
+
+    try:
+        while True:
+            try:
+                client, _ = server.accept()
+            except socket.timeout:
+                break
+            with client:
+                client.settimeout(None)
+                handle_prefetch_request(client, token)
+    finally:
+        server.close()
+        if PREFETCH_SOCKET.exists():
+            PREFETCH_SOCKET.unlink()
+        RESIDENT = False
+        close_db_connection()
+
+
+# shell集成脚本：输入 "ai " 时在后台预热常驻进程
+SHELL_INIT_SCRIPTS = {
+    'bash': '''_ai_prefetch_space() {
+    READLINE_LINE="${READLINE_LINE:0:READLINE_POINT} ${READLINE_LINE:READLINE_POINT}"
+    READLINE_POINT=$((READLINE_POINT + 1))
+    if [[ "$READLINE_LINE" == "ai " ]]; then
+        ({prefetch} >/dev/null 2>&1 &)
+    fi
+}
+bind -x '" ": _ai_prefetch_space'
+''',
+    'zsh': '''_ai_prefetch_check() {
+    if [[ -z "$_ai_prefetched" && "$BUFFER" == "ai "* ]]; then
+        _ai_prefetched=1
+        ({prefetch} >/dev/null 2>&1 &)
+    fi
+}
+_ai_prefetch_reset() { _ai_prefetched= }
+autoload -Uz add-zle-hook-widget
+add-zle-hook-widget line-pre-redraw _ai_prefetch_check
+add-zle-hook-widget line-init _ai_prefetch_reset
+''',
+}
+
+
+def get_shell_init_script(shell):
+    """生成指定shell的集成脚本"""
+    if getattr(sys, 'frozen', False):
+        program = f'"{sys.executable}"'
+    else:
+        program = f'"{sys.executable}" "{Path(__file__).resolve()}"'
+    return SHELL_INIT_SCRIPTS[shell].replace('{prefetch}', f"{program} --prefetch")
+
+
+# 修改main函数
+def main(argv=None):
+    global conn
     
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='AI聊天助手工具')
@@ -609,9 +2049,61 @@ def main():
     parser.add_argument('-r', metavar='ROLE', help='指定角色')
     parser.add_argument('-m', metavar='MODE', nargs='?', const='',
                       help='会话模式：start, list(l), 数字(1-5)或范围(2-4)，不带参数则使用当前活跃会话')
+    parser.add_argument('-u', metavar='PERIOD', nargs='?', const='day', choices=['day', 'hour', 'session'],
+                      help='用量统计：day（最近7天，默认）、hour（最近24小时）或 session（最近10个会话）')
+    parser.add_argument('--shell-init', metavar='SHELL', choices=sorted(SHELL_INIT_SCRIPTS),
+                      help='输出shell集成脚本（bash或zsh），用于输入时预热')
+    parser.add_argument('--prefetch', action='store_true', help='预热常驻进程（由shell集成脚本调用）')
+    parser.add_argument('--serve', action='store_true', help='运行常驻预热进程')
+    parser.add_argument('--sync-push', metavar='DIR', help='将本地新增的记录推送到共享目录')
+    parser.add_argument('--sync-pull', metavar='DIR', help='从共享目录合并其他主机的记录')
+    parser.add_argument('--sync-serve', metavar='[HOST:]PORT', help='启动同步服务，等待其他主机连接')
+    parser.add_argument('--sync-with', metavar='HOST:PORT', help='与同步服务交换记录')
     parser.add_argument('message', nargs='*', help='要发送给AI的消息')
     
-    args = parser.parse_args()
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parser.parse_args(argv)
+    
+    # 常驻预热进程相关命令
+    if args.shell_init:
+        print(get_shell_init_script(args.shell_init))
+        return
+    if args.prefetch:
+        start_prefetch()
+        return
+    if args.serve:
+        serve_prefetch()
+        return
+    
+    # 同步命令
+    if args.sync_push or args.sync_pull or args.sync_serve or args.sync_with:
+        cursor = init_db_connection()
+        init_db(cursor)
+        if args.sync_pull:
+            sync_pull_dir(cursor, args.sync_pull)
+        if args.sync_push:
+            sync_push_dir(cursor, args.sync_push)
+        if args.sync_with:
+            sync_with(cursor, args.sync_with)
+        if args.sync_serve:
+            sync_serve(cursor, args.sync_serve)
+        close_db_connection()
+        return
+    
+    # 常驻进程已运行时交给它执行；代码执行模式需要终端交互，始终在本进程执行
+    if not RESIDENT and not args.e:
+        status = forward_to_prefetch_server(argv)
+        if status is not None:
+            if status:
+                sys.exit(status)
+            return
+    
+    # 初始化数据库连接
+    cursor = init_db_connection()
+    
+    # 初始化数据库
+    init_db(cursor)
     
     # 确定角色
     role = 'default'
@@ -620,6 +2112,11 @@ def main():
     elif args.r:
         role = args.r
     
+    # 用量统计
+    if args.u:
+        print(format_usage_report(get_usage_report(cursor, args.u)))
+        return
+
     # 处理会话模式
     if args.m is not None:  # 注意：args.m可能是空字符串
         # 处理list命令及其简写形式
@@ -636,33 +2133,7 @@ def main():
             
             # 处理消息
             if args.message:
-                message = ' '.join(args.message)
-                
-                # 在非代码执行和自定义角色模式下，添加中文回答提示
-                if not args.e and not args.r:
-                    message = message + " ;answer by Chinese"
-                
-                cmd_args = []
-                if args.e:
-                    cmd_args.append('-e')
-                if args.r:
-                    cmd_args.extend(['-r', args.r])
-                cmd_args.append(message)
-                
-                output, suggested_cmd = run_aichat_command(cmd_args)
-                
-                # 代码执行模式下，使用捕获的命令建议作为答案
-                if args.e and suggested_cmd:
-                    answer = suggested_cmd
-                else:
-                    answer = extract_answer_from_output(output, args.e)
-                
-                save_chat_record(cursor, message, answer, output, role)
-                
-                # 对于代码执行模式，output已经在终端显示，不需要再次打印
-                if not args.e:
-                    print(output)
-            
+                ask(cursor, args, role, ' '.join(args.message))
             return
         
         elif args.m == '':  # -m不带参数
@@ -676,37 +2147,8 @@ def main():
                 print("错误：请提供要发送给AI的消息")
                 return
             
-            # 在非代码执行和自定义角色模式下，添加中文回答提示
-            original_message = message
-            if not args.e and not args.r:
-                message = message + "; answer by Chinese"
-                
-            # 获取当前活跃会话的所有消息
-            records = get_active_session_messages(cursor)
-            param_list = create_param_list(records)
-            
-            # 添加当前问题
-            param_list.append({"problem": message})
-            
-            # 调用aichat并传入历史记录
-            cmd_args = []
-            if args.e:
-                cmd_args.append('-e')
-            
-            output, suggested_cmd = run_aichat_command(cmd_args, param_list)
-            
-            # 代码执行模式下，使用捕获的命令建议作为答案
-            if args.e and suggested_cmd:
-                answer = suggested_cmd
-            else:
-                answer = extract_answer_from_output(output, args.e)
-            
-            # 保存原始问题，而不是添加了提示的问题
-            save_chat_record(cursor, original_message, answer, output, role)
-            
-            # 对于代码执行模式，output已经在终端显示，不需要再次打印
-            if not args.e:
-                print(output)
+            # 携带当前活跃会话的所有消息（常驻进程中可能已预先读取）
+            ask(cursor, args, role, message, get_session_records(cursor))
             return
         
         else:
@@ -716,11 +2158,6 @@ def main():
                 print("错误：使用-m参数时需要提供消息内容")
                 return
             
-            # 在非代码执行和自定义角色模式下，添加中文回答提示
-            original_message = message
-            if not args.e and not args.r:
-                message = message + "; answer by Chinese"
-            
             # 解析范围并获取对应的记录
             ids = []
             if '-' in args.m or ',' in args.m:
@@ -739,31 +2176,7 @@ def main():
                     print(f"错误：无效的-m参数值 '{args.m}'")
                     return
             
-            records = get_chat_by_ids(cursor, ids)
-            param_list = create_param_list(records)
-            
-            # 添加当前问题
-            param_list.append({"problem": message})
-            
-            # 调用aichat并传入历史记录
-            cmd_args = []
-            if args.e:
-                cmd_args.append('-e')
-                
-            output, suggested_cmd = run_aichat_command(cmd_args, param_list)
-            
-            # 代码执行模式下，使用捕获的命令建议作为答案
-            if args.e and suggested_cmd:
-                answer = suggested_cmd
-            else:
-                answer = extract_answer_from_output(output, args.e)
-            
-            # 保存原始问题，而不是添加了提示的问题
-            save_chat_record(cursor, original_message, answer, output, role)
-            
-            # 对于代码执行模式，output已经在终端显示，不需要再次打印
-            if not args.e:
-                print(output)
+            ask(cursor, args, role, message, get_chat_by_ids(cursor, ids))
             return
     
     # 普通模式处理
@@ -772,32 +2185,7 @@ def main():
         print("请提供要发送给AI的消息")
         return
     
-    # 在非代码执行和自定义角色模式下，添加中文回答提示
-    original_message = message
-    if not args.e and not args.r:
-        message = message + "; answer by Chinese"
-    
-    cmd_args = []
-    if args.e:
-        cmd_args.append('-e')
-    if args.r:
-        cmd_args.extend(['-r', args.r])
-    cmd_args.append(message)
-    
-    output, suggested_cmd = run_aichat_command(cmd_args)
-    
-    # 代码执行模式下，使用捕获的命令建议作为答案
-    if args.e and suggested_cmd:
-        answer = suggested_cmd
-    else:
-        answer = extract_answer_from_output(output, args.e)
-    
-    # 保存原始问题，而不是添加了提示的问题
-    save_chat_record(cursor, original_message, answer, output, role)
-    
-    # 对于代码执行模式，output已经在终端显示，不需要再次打印
-    if not args.e:
-        print(output)
+    ask(cursor, args, role, message)
     
     # 关闭数据库连接
     close_db_connection()
@@ -0,0 +1,100 @@
+"""测量流式Markdown渲染的吞吐量（每秒字符数），目标是每秒一万个以上中文字符
+
+模拟模型逐块返回的中文Markdown回答（标题、列表、行内代码和代码块），分别测量：
+- 渲染器：按文本块调用 StreamRenderer.feed（输出到伪终端）
+- 完整流程：stream_process_output 按字节块增量解码后渲染
+
+用法：python benchmarks/bench_render.py [--chunk 16] [--repeat 20]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import ai  # noqa: E402
+
+ANSWER = (
+    "# 查看磁盘占用\n\n"
+    "可以使用 `du` 命令统计目录大小，用 **sort** 排序：\n\n"
+    "- 第一步：进入需要统计的目录\n"
+    "- 第二步：运行下面的命令，找出占用空间最大的文件和目录\n\n"
+    "```bash\n"
+    "# 按大小排序，只显示前十项\n"
+    "du -sh * | sort -rh | head -n 10\n"
+    "```\n\n"
+    "> 提示：统计大目录时可能需要几秒钟，请耐心等待输出结果。\n"
+)
+
+
+class FakeTTY(io.StringIO):
+    """伪装成终端的输出流"""
+
+    def isatty(self):
+        return True
+
+
+class FakeProcess:
+    """按给定分块返回输出的子进程"""
+
+    def __init__(self, chunks):
+        self.stdout = self
+        self.chunks = iter(chunks)
+
+    def read(self, size=-1):
+        return next(self.chunks, b'')
+
+    def wait(self):
+        return 0
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def measure(label, run, chars, repeat):
+    """多次运行取最优，打印每秒字符数"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label}: {chars / best:,.0f} 字符/秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量流式Markdown渲染的吞吐量")
+    parser.add_argument('--chunk', type=int, default=16, help="每块的字符数（字节块为其三倍）")
+    parser.add_argument('--repeat', type=int, default=20, help="重复次数")
+    args = parser.parse_args()
+
+    os.environ.pop('NO_COLOR', None)
+    text = ANSWER * 50
+    text_chunks = split(text, args.chunk)
+    byte_chunks = split(text.encode('utf-8'), args.chunk * 3)
+
+    def run_renderer():
+        renderer = ai.StreamRenderer(FakeTTY())
+        for chunk in text_chunks:
+            renderer.feed(chunk)
+        renderer.close()
+
+    def run_stream():
+        stdout = sys.stdout
+        sys.stdout = FakeTTY()
+        try:
+            ai.stream_process_output(FakeProcess(byte_chunks))
+        finally:
+            sys.stdout = stdout
+
+    print(f"回答共 {len(text)} 个字符，{len(text_chunks)} 块")
+    measure("渲染器", run_renderer, len(text), args.repeat)
+    measure("完整流程（增量解码+渲染）", run_stream, len(text), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""测量提示词模板的开销：规范化问题文本、渲染模板和按角色取模板
+
+对比每次都重新创建模板与使用缓存模板（get_prompt_template）的耗时。
+
+用法：python benchmarks/bench_templates.py [--number 100000]
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import ai  # noqa: E402
+
+SHORT_MESSAGE = "如何  查看 当前目录下  最大的文件"
+CODE_MESSAGE = "下面的代码为什么报错\ndef f(items):\n    for item in  items:\n        print(item)   \n" * 5
+
+
+def measure(label, stmt, number):
+    """多次运行取最优，打印单次耗时（微秒）"""
+    best = min(timeit.repeat(stmt, number=number, repeat=5))
+    print(f"{label}: {best / number * 1e6:.2f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量提示词模板的开销")
+    parser.add_argument('--number', type=int, default=100000, help="每轮执行次数")
+    args = parser.parse_args()
+
+    template = ai.get_prompt_template('default')
+    measure("规范化（短问题）", lambda: ai.normalize_prompt(SHORT_MESSAGE), args.number)
+    measure("规范化（代码片段）", lambda: ai.normalize_prompt(CODE_MESSAGE), args.number)
+    measure("渲染（短问题）", lambda: template.render(SHORT_MESSAGE), args.number)
+    measure("取模板（缓存）", lambda: ai.get_prompt_template('default'), args.number)
+    measure("取模板（每次新建）", lambda: ai.PromptTemplate(**ai.load_prompt_templates()['default']), args.number)
+
+
+if __name__ == '__main__':
+    main()
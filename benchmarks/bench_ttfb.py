@@ -0,0 +1,84 @@
+"""测量首字节时间（TTFB）：从按下回车（启动 ai.py）到终端收到第一个回答字节
+
+对比两种情况：
+- 冷启动：每次都新建进程、初始化数据库、建立连接
+- 常驻预热：先运行 --prefetch（模拟输入 "ai " 时 shell 集成脚本的调用），再执行请求
+
+使用本地模拟的 OpenAI 兼容接口，--delay 模拟模型首个 token 的延迟。
+
+用法：python benchmarks/bench_ttfb.py [--runs 10] [--delay 0.05]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "tests"))
+
+from mock_openai import MockOpenAIServer  # noqa: E402
+
+AI_PY = str(ROOT / "ai.py")
+
+
+def time_first_byte(env):
+    """启动一次请求，返回收到第一个输出字节的耗时（秒）"""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, AI_PY, "你好"], env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    process.stdout.read(1)
+    elapsed = time.perf_counter() - start
+    process.stdout.read()
+    process.wait()
+    return elapsed
+
+
+def wait_for_socket(path, timeout=10):
+    """等待常驻进程开始监听"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if path.exists():
+            return
+        time.sleep(0.02)
+    raise RuntimeError("常驻进程未能启动")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量 ai.py 的首字节时间")
+    parser.add_argument('--runs', type=int, default=10, help='每种情况的运行次数')
+    parser.add_argument('--delay', type=float, default=0.05, help='模拟的模型首 token 延迟（秒）')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir, MockOpenAIServer(first_byte_delay=args.delay) as mock:
+        workdir = Path(workdir)
+        env = dict(os.environ, AI_BACKEND='openai', AI_BASE_URL=mock.base_url,
+                   AI_DB_PATH=str(workdir / "bench.db"), AI_PREFETCH_DIR=str(workdir / "run"),
+                   NO_COLOR='1')
+
+        cold = [time_first_byte(env) for _ in range(args.runs)]
+
+        server = subprocess.Popen([sys.executable, AI_PY, '--serve'], env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_socket(workdir / "run" / "ai-prefetch.sock")
+            warm = []
+            for _ in range(args.runs):
+                # 预热发生在用户输入期间，不计入首字节时间
+                subprocess.run([sys.executable, AI_PY, '--prefetch'], env=env, check=True)
+                warm.append(time_first_byte(env))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"模拟模型首 token 延迟: {args.delay * 1000:.0f} ms，每种情况 {args.runs} 次")
+    for name, samples in (("冷启动", cold), ("常驻预热", warm)):
+        print(f"{name}: 中位数 {statistics.median(samples) * 1000:.1f} ms，"
+              f"最小 {min(samples) * 1000:.1f} ms，最大 {max(samples) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
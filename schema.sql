@@ -5,7 +5,13 @@ CREATE TABLE IF NOT EXISTS chat_history (
     problem TEXT NOT NULL,      -- 用户输入的问题
     answer TEXT,                -- aichat返回的答案或要执行的命令
     output TEXT,                -- 实际输出的结果
-    role TEXT DEFAULT 'default' -- 角色：default, code, 或自定义角色
+    role TEXT DEFAULT 'default', -- 角色：default, code, 或自定义角色
+    output_bytes INTEGER,       -- 代码执行模式下命令输出的总字节数
+    output_sha256 TEXT,         -- 命令完整输出的SHA-256
+    output_file TEXT,           -- 完整输出的压缩文件路径（仅输出被截断时）
+    uuid TEXT,                  -- 全局唯一ID，用于多数据库同步
+    origin_id TEXT,             -- 产生该记录的数据库ID
+    seq INTEGER                 -- 在来源数据库中的变更序号
 );
 
 -- 会话管理表
@@ -13,7 +19,9 @@ CREATE TABLE IF NOT EXISTS sessions (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     session_id TEXT NOT NULL,   -- 会话ID
     start_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-    is_active INTEGER DEFAULT 1 -- 1表示活跃会话，0表示已结束
+    is_active INTEGER DEFAULT 1, -- 1表示活跃会话，0表示已结束
+    origin_id TEXT,
+    seq INTEGER
 );
 
 -- 会话消息关联表
@@ -21,6 +29,64 @@ CREATE TABLE IF NOT EXISTS session_messages (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     session_id INTEGER,
     message_id INTEGER,
+    origin_id TEXT,
+    seq INTEGER,
     FOREIGN KEY (session_id) REFERENCES sessions(id),
     FOREIGN KEY (message_id) REFERENCES chat_history(id)
-); 
\ No newline at end of file
+); 
+-- 单次请求用量明细（token数为估算值）
+CREATE TABLE IF NOT EXISTS usage_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id INTEGER,
+    session_id INTEGER,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    role TEXT DEFAULT 'default',
+    prompt_tokens INTEGER DEFAULT 0,      -- 发送内容的估算token数
+    completion_tokens INTEGER DEFAULT 0,  -- 返回内容的估算token数
+    context_bytes INTEGER DEFAULT 0,      -- 携带的历史上下文字节数
+    stream_bytes INTEGER DEFAULT 0,       -- 返回内容的字节数
+    cost REAL DEFAULT 0,                  -- 按配置单价估算的费用
+    FOREIGN KEY (message_id) REFERENCES chat_history(id),
+    FOREIGN KEY (session_id) REFERENCES sessions(id)
+);
+CREATE INDEX IF NOT EXISTS idx_usage_log_session ON usage_log(session_id);
+
+-- 按小时汇总的用量（UTC，period格式：YYYY-MM-DD HH:00）
+CREATE TABLE IF NOT EXISTS usage_hourly (
+    period TEXT NOT NULL,
+    role TEXT NOT NULL,
+    requests INTEGER DEFAULT 0,
+    prompt_tokens INTEGER DEFAULT 0,
+    completion_tokens INTEGER DEFAULT 0,
+    context_bytes INTEGER DEFAULT 0,
+    stream_bytes INTEGER DEFAULT 0,
+    cost REAL DEFAULT 0,
+    PRIMARY KEY (period, role)
+);
+
+-- 按天汇总的用量（UTC，period格式：YYYY-MM-DD）
+CREATE TABLE IF NOT EXISTS usage_daily (
+    period TEXT NOT NULL,
+    role TEXT NOT NULL,
+    requests INTEGER DEFAULT 0,
+    prompt_tokens INTEGER DEFAULT 0,
+    completion_tokens INTEGER DEFAULT 0,
+    context_bytes INTEGER DEFAULT 0,
+    stream_bytes INTEGER DEFAULT 0,
+    cost REAL DEFAULT 0,
+    PRIMARY KEY (period, role)
+);
+
+-- 同步状态：本数据库的来源ID（origin_id）和最后分配的变更序号（seq）
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+-- 已推送到各个目标的最大序号（peer为目标，如 file:/path/to/dir）
+CREATE TABLE IF NOT EXISTS sync_peers (
+    peer TEXT NOT NULL,
+    origin_id TEXT NOT NULL,
+    last_seq INTEGER DEFAULT 0,
+    PRIMARY KEY (peer, origin_id)
+);
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# ai.py 位于仓库根目录
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,54 @@
+"""本地模拟的OpenAI兼容接口，用于测试和基准测试"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockOpenAIServer:
+    """以SSE流式返回固定分块的 /chat/completions 服务，记录请求和客户端连接"""
+
+    def __init__(self, chunks=("你好", "，", "world"), first_byte_delay=0.0):
+        self.chunks = list(chunks)
+        self.first_byte_delay = first_byte_delay
+        self.requests = []
+        self.client_ports = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers['Content-Length'])
+                server.requests.append(json.loads(self.rfile.read(length)))
+                server.client_ports.append(self.client_address[1])
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                if server.first_byte_delay:
+                    time.sleep(server.first_byte_delay)
+                for text in server.chunks:
+                    event = {"choices": [{"delta": {"content": text}}]}
+                    self._write_chunk(b'data: ' + json.dumps(event).encode('utf-8') + b'\n\n')
+                self._write_chunk(b'data: [DONE]\n\n')
+                self.wfile.write(b'0\r\n\r\n')
+
+            def _write_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,61 @@
+import pytest
+
+import ai
+from mock_openai import MockOpenAIServer
+
+
+@pytest.fixture
+def server():
+    with MockOpenAIServer(chunks=["你好", "，", "world"]) as mock:
+        yield mock
+
+
+def test_streams_sse_chunks(server, capsys):
+    backend = ai.OpenAIBackend(base_url=server.base_url, model='test-model')
+
+    output, suggested = backend.run(['讲一个笑话'])
+
+    assert output == "你好，world"
+    assert suggested is None
+    assert "你好，world" in capsys.readouterr().out
+    request = server.requests[0]
+    assert request["model"] == 'test-model'
+    assert request["stream"] is True
+    assert request["messages"] == [{"role": "user", "content": "讲一个笑话"}]
+
+
+def test_reuses_pooled_connection(server):
+    backend = ai.OpenAIBackend(base_url=server.base_url)
+
+    for _ in range(3):
+        backend.run(['hi'])
+
+    assert len(server.requests) == 3
+    assert len(set(server.client_ports)) == 1
+
+
+def test_history_and_role_become_messages(server):
+    backend = ai.OpenAIBackend(base_url=server.base_url)
+
+    backend.run(['-r', '教授'], [{"problem": "a", "output": "b"}, {"problem": "c"}])
+
+    assert server.requests[0]["messages"] == [
+        {"role": "system", "content": "你现在的角色是: 教授"},
+        {"role": "user", "content": "a"},
+        {"role": "assistant", "content": "b"},
+        {"role": "user", "content": "c"},
+    ]
+
+
+def test_connection_error_is_reported(capsys):
+    backend = ai.OpenAIBackend(base_url="http://127.0.0.1:1/v1")
+
+    output, _ = backend.run(['hi'])
+
+    assert output.startswith("错误: 无法连接接口")
+    assert "无法连接接口" in capsys.readouterr().out
+
+
+def test_backend_requires_run():
+    with pytest.raises(TypeError):
+        ai.AichatBackend()
@@ -0,0 +1,65 @@
+import sys
+
+import pytest
+
+import ai
+
+
+def python_cmd(code):
+    return [sys.executable, '-c', code]
+
+
+@pytest.fixture
+def small_window(monkeypatch):
+    monkeypatch.setattr(ai, 'OUTPUT_HEAD_BYTES', 10)
+    monkeypatch.setattr(ai, 'OUTPUT_TAIL_BYTES', 10)
+    monkeypatch.setattr(ai, 'OUTPUT_SPILL_DIR', '')
+
+
+def test_short_output_is_kept_whole(small_window):
+    capture = ai.capture_command_output(python_cmd("print('hi')"), echo=False)
+
+    assert capture.text.strip() == 'hi'
+    assert capture.spill_path is None
+    assert capture.returncode == 0
+
+
+def test_long_output_keeps_head_and_tail(small_window):
+    capture = ai.capture_command_output(python_cmd("print('x' * 1000, end='')"), echo=False)
+
+    assert capture.total_bytes == 1000
+    assert capture.text == 'x' * 10 + '\n... [省略 980 字节] ...\n' + 'x' * 10
+
+
+def test_head_is_trimmed_to_character_boundary(small_window):
+    # 每个汉字3字节，10字节的头部窗口在第4个汉字中间截断
+    capture = ai.capture_command_output(python_cmd("import sys; sys.stdout.buffer.write(('中' * 100).encode())"), echo=False)
+
+    assert capture.text.startswith('中中中\n... [省略 281 字节]')
+    assert '�' not in capture.text.split('\n')[0]
+
+
+def test_utf8_boundary():
+    data = '中文'.encode('utf-8')
+    assert ai.utf8_boundary(data) == 6
+    assert ai.utf8_boundary(data[:5]) == 3
+    assert ai.utf8_boundary(data[:4]) == 3
+    assert ai.utf8_boundary(b'abc') == 3
+
+
+def test_truncated_output_is_spilled(small_window, monkeypatch, tmp_path):
+    monkeypatch.setattr(ai, 'OUTPUT_SPILL_DIR', str(tmp_path))
+
+    capture = ai.capture_command_output(python_cmd("print('y' * 1000, end='')"), echo=False)
+
+    import gzip
+    assert gzip.decompress(capture.spill_path.read_bytes()) == b'y' * 1000
+
+
+def test_failed_start_leaves_no_spill_file(small_window, monkeypatch, tmp_path):
+    monkeypatch.setattr(ai, 'OUTPUT_SPILL_DIR', str(tmp_path))
+
+    with pytest.raises(OSError):
+        ai.capture_command_output(['/nonexistent/command'], echo=False)
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import stat
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from mock_openai import MockOpenAIServer
+
+AI_PY = str(Path(__file__).resolve().parent.parent / "ai.py")
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason="POSIX套接字")
+
+
+@pytest.fixture
+def resident(tmp_path):
+    with MockOpenAIServer(chunks=["常驻", "回答"]) as mock:
+        env = dict(os.environ, AI_BACKEND='openai', AI_BASE_URL=mock.base_url,
+                   AI_DB_PATH=str(tmp_path / 'r.db'), AI_PREFETCH_DIR=str(tmp_path / 'run'),
+                   AI_PREFETCH_IDLE_TIMEOUT='30')
+        server = subprocess.Popen([sys.executable, AI_PY, '--serve'], env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        socket_path = tmp_path / 'run' / 'ai-prefetch.sock'
+        for _ in range(100):
+            if socket_path.exists():
+                break
+            time.sleep(0.05)
+        try:
+            yield env, tmp_path
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def run_ai(env, *args):
+    return subprocess.run([sys.executable, AI_PY, *args], env=env, capture_output=True, text=True)
+
+
+def test_socket_directory_is_private(resident):
+    _, tmp_path = resident
+    run_dir = tmp_path / 'run'
+
+    assert stat.S_IMODE(run_dir.stat().st_mode) == 0o700
+    assert stat.S_IMODE((run_dir / 'ai-prefetch.sock').stat().st_mode) & 0o077 == 0
+
+
+def test_forwarded_request_streams_output(resident):
+    env, _ = resident
+
+    result = run_ai(env, '你好')
+
+    assert result.returncode == 0
+    assert "常驻回答" in result.stdout
+
+
+def test_start_session_is_committed(resident):
+    env, tmp_path = resident
+
+    assert run_ai(env, '-m', 'start').returncode == 0
+
+    # 常驻进程不能持有写事务：其他进程可以立即看到会话并写入
+    db = sqlite3.connect(tmp_path / 'r.db', timeout=0.5)
+    assert db.execute("SELECT COUNT(*) FROM sessions WHERE is_active = 1").fetchone()[0] == 1
+    db.execute("BEGIN IMMEDIATE")
+    db.rollback()
+    db.close()
+
+
+def test_changed_settings_run_locally(resident):
+    env, tmp_path = resident
+    other_db = tmp_path / 'other.db'
+
+    result = run_ai(dict(env, AI_DB_PATH=str(other_db)), '你好')
+
+    # 常驻进程的数据库与客户端不同，请求在客户端本地执行并写入客户端的数据库
+    assert result.returncode == 0
+    assert "常驻回答" in result.stdout
+    db = sqlite3.connect(other_db)
+    assert db.execute("SELECT COUNT(*) FROM chat_history").fetchone()[0] == 1
+    db.close()
+    db = sqlite3.connect(tmp_path / 'r.db')
+    assert db.execute("SELECT COUNT(*) FROM chat_history").fetchone()[0] == 0
+    db.close()
@@ -0,0 +1,103 @@
+"""流式Markdown渲染：代码块、只重绘当前行、折行、非终端直通和跨块的多字节字符"""
+import io
+import os
+
+import pytest
+
+import ai
+
+
+class FakeTTY(io.StringIO):
+    """伪装成终端的输出流"""
+
+    def isatty(self):
+        return True
+
+
+class FakeProcess:
+    """按给定分块返回输出的子进程"""
+
+    def __init__(self, chunks):
+        self.stdout = self
+        self.chunks = list(chunks)
+
+    def read(self, size=-1):
+        return self.chunks.pop(0) if self.chunks else b''
+
+    def wait(self):
+        return 0
+
+
+@pytest.fixture
+def tty(monkeypatch):
+    monkeypatch.delenv('NO_COLOR', raising=False)
+    monkeypatch.setattr(ai, 'client_terminal_columns', None)
+    monkeypatch.setattr(ai.shutil, 'get_terminal_size', lambda *args: os.terminal_size((20, 24)))
+    return FakeTTY()
+
+
+def render(stream, *chunks):
+    renderer = ai.StreamRenderer(stream)
+    for chunk in chunks:
+        renderer.feed(chunk)
+    renderer.close()
+    return renderer, stream.getvalue()
+
+
+def test_fence_across_chunks(tty):
+    renderer, out = render(tty, "```py", "thon\nreturn 1\n``", "`\n**b**\n")
+
+    assert not renderer.in_code
+    assert ai.STYLE_DIM + "```python" + ai.STYLE_RESET in out
+    assert ai.STYLE_KEYWORD + "return" + ai.STYLE_RESET in out
+    # 代码块结束后恢复行内样式
+    assert out.endswith(ai.STYLE_BOLD + "b" + ai.STYLE_RESET + "\n")
+
+
+def test_only_current_line_is_redrawn(tty):
+    _, out = render(tty, "plain line\n# Tit", "le\nuse `l", "s`\n")
+
+    assert out == ("plain line\n# Tit"
+                   + ai.CLEAR_LINE + ai.STYLE_HEADING + "# Title" + ai.STYLE_RESET + "\nuse `l"
+                   + ai.CLEAR_LINE + "use " + ai.STYLE_INLINE_CODE + "ls" + ai.STYLE_RESET + "\n")
+
+
+def test_complete_line_is_styled_without_redraw(tty):
+    _, out = render(tty, "# Title\n")
+
+    assert out == ai.STYLE_HEADING + "# Title" + ai.STYLE_RESET + "\n"
+
+
+def test_wrapped_line_is_not_redrawn(tty):
+    # 终端20列，已输出的部分占42列，已经折行
+    _, out = render(tty, "# " + "标题" * 10, "\n")
+
+    assert ai.CLEAR_LINE not in out
+    assert out == "# " + "标题" * 10 + "\n"
+
+
+def test_passthrough_when_not_a_tty(tty):
+    stream = io.StringIO()
+
+    _, out = render(stream, "# Title\n`code` and **bold**", "\n")
+
+    assert out == "# Title\n`code` and **bold**\n"
+
+
+def test_no_color_disables_styles(tty, monkeypatch):
+    monkeypatch.setenv('NO_COLOR', '1')
+
+    _, out = render(tty, "# Title\n")
+
+    assert out == "# Title\n"
+
+
+def test_multibyte_character_split_across_reads(monkeypatch):
+    stream = io.StringIO()
+    monkeypatch.setattr(ai.sys, 'stdout', stream)
+    data = "中文回答\n".encode('utf-8')
+
+    text = ai.stream_process_output(FakeProcess([data[:1], data[1:4], data[4:]]))
+
+    assert text == "中文回答\n"
+    assert stream.getvalue() == "中文回答\n"
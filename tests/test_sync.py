@@ -0,0 +1,166 @@
+import gzip
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+import ai
+
+AI_PY = str(Path(__file__).resolve().parent.parent / "ai.py")
+
+
+def open_db(monkeypatch, path):
+    """切换到指定数据库（ai使用全局连接）"""
+    ai.close_db_connection()
+    monkeypatch.setattr(ai, 'DB_PATH', path)
+    monkeypatch.setattr(ai, '_origin_id', None)
+    cursor = ai.init_db_connection()
+    ai.init_db(cursor)
+    return cursor
+
+
+@pytest.fixture(autouse=True)
+def close_after(monkeypatch):
+    monkeypatch.setattr(ai, 'SYNC_TOKEN', '')
+    yield
+    ai.close_db_connection()
+
+
+def test_push_and_pull_through_directory(monkeypatch, tmp_path):
+    share = tmp_path / 'share'
+    cursor = open_db(monkeypatch, tmp_path / 'a.db')
+    ai.start_session(cursor)
+    ai.save_chat_record(cursor, '问题A', 'a', '回答A')
+    ai.sync_push_dir(cursor, share)
+    ai.sync_push_dir(cursor, share)
+    assert len(list(share.iterdir())) == 1
+
+    cursor = open_db(monkeypatch, tmp_path / 'b.db')
+    ai.sync_pull_dir(cursor, share)
+    ai.sync_pull_dir(cursor, share)
+
+    cursor.execute("SELECT problem FROM chat_history")
+    assert cursor.fetchall() == [('问题A',)]
+    # 远端会话只作为历史导入，成员关系一并同步
+    cursor.execute("SELECT is_active, COUNT(sm.id) FROM sessions s JOIN session_messages sm ON sm.session_id = s.id")
+    assert cursor.fetchall() == [(0, 1)]
+
+
+@pytest.mark.parametrize('changes', [
+    [1, 2],
+    {"chats": [["only-uuid"]]},
+    {"chats": [[str(i), None, 'p', None, None, 'default', None, None, 'o', i] for i in range(2)] + [[None]]},
+])
+def test_malformed_changes_are_rolled_back(monkeypatch, tmp_path, changes):
+    cursor = open_db(monkeypatch, tmp_path / 'a.db')
+
+    with pytest.raises(ai.SYNC_ERRORS):
+        ai.import_changes(cursor, changes)
+
+    cursor.execute("SELECT COUNT(*) FROM chat_history")
+    assert cursor.fetchone()[0] == 0
+
+
+def test_oversized_payload_is_rejected(monkeypatch):
+    monkeypatch.setattr(ai, 'SYNC_MAX_PAYLOAD_BYTES', 100)
+    data = gzip.compress(json.dumps({"chats": ["x" * 1000]}).encode('utf-8'))
+
+    with pytest.raises(ValueError):
+        ai.unpack_changes(data)
+
+
+def test_serve_refuses_public_bind_without_token(monkeypatch, tmp_path, capsys):
+    cursor = open_db(monkeypatch, tmp_path / 'a.db')
+
+    ai.sync_serve(cursor, '0.0.0.0:0')
+
+    assert 'AI_SYNC_TOKEN' in capsys.readouterr().out
+
+
+def test_token_comparison(monkeypatch):
+    monkeypatch.setattr(ai, 'SYNC_TOKEN', 'secret')
+
+    assert ai.check_sync_token('secret')
+    assert not ai.check_sync_token('wrong')
+    assert not ai.check_sync_token(None)
+
+
+def test_sync_with_refused_connection_reports_error(monkeypatch, tmp_path, capsys):
+    cursor = open_db(monkeypatch, tmp_path / 'a.db')
+
+    ai.sync_with(cursor, '127.0.0.1:1')
+
+    assert capsys.readouterr().out.startswith('错误：同步失败')
+
+
+def test_pull_skips_batch_that_is_not_gzip(monkeypatch, tmp_path, capsys):
+    share = tmp_path / 'share'
+    share.mkdir()
+    (share / 'other-0000000001-0000000001.json.gz').write_bytes(b'hello')
+    cursor = open_db(monkeypatch, tmp_path / 'a.db')
+
+    ai.sync_pull_dir(cursor, share)
+
+    assert '跳过无法读取的批次' in capsys.readouterr().out
+
+
+def test_failed_batch_is_retried_with_later_batches(monkeypatch, tmp_path, capsys):
+    share = tmp_path / 'share'
+    cursor = open_db(monkeypatch, tmp_path / 'a.db')
+    ai.save_chat_record(cursor, '问题1', 'a', '回答1')
+    ai.sync_push_dir(cursor, share)
+    ai.save_chat_record(cursor, '问题2', 'a', '回答2')
+    ai.sync_push_dir(cursor, share)
+    first = sorted(share.iterdir())[0]
+    original = first.read_bytes()
+    first.write_bytes(gzip.compress(b'not json'))
+
+    cursor = open_db(monkeypatch, tmp_path / 'b.db')
+    ai.sync_pull_dir(cursor, share)
+    cursor.execute("SELECT COUNT(*) FROM chat_history")
+    assert cursor.fetchone()[0] == 0
+
+    # 修复批次文件后重新拉取，两个批次都能合并
+    first.write_bytes(original)
+    ai.sync_pull_dir(cursor, share)
+    cursor.execute("SELECT problem FROM chat_history ORDER BY seq")
+    assert cursor.fetchall() == [('问题1',), ('问题2',)]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_serve_survives_frame_that_is_not_gzip(monkeypatch, tmp_path, capsys):
+    address = f"127.0.0.1:{free_port()}"
+    env = dict(os.environ, AI_DB_PATH=str(tmp_path / 'server.db'), AI_PREFETCH_DIR=str(tmp_path / 'run'))
+    env.pop('AI_SYNC_TOKEN', None)
+    server = subprocess.Popen([sys.executable, AI_PY, '--sync-serve', address], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                sock = socket.create_connection(ai.parse_sync_address(address), timeout=5)
+                break
+            except OSError:
+                time.sleep(0.05)
+        with sock:
+            sock.sendall(struct.pack('>I', 5) + b'hello')
+            sock.recv(1)
+
+        cursor = open_db(monkeypatch, tmp_path / 'client.db')
+        ai.sync_with(cursor, address)
+
+        assert server.poll() is None
+        assert capsys.readouterr().out.startswith('合并 0 条变更')
+    finally:
+        server.terminate()
+        server.wait()
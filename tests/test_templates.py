@@ -0,0 +1,74 @@
+"""提示词模板：内置/自定义角色、模板文件覆盖、无效配置和问题文本规范化"""
+import json
+
+import pytest
+
+import ai
+
+
+@pytest.fixture
+def templates_file(tmp_path, monkeypatch):
+    """把模板文件指向临时路径，并清空模板缓存"""
+    path = tmp_path / "ai_templates.json"
+    monkeypatch.setattr(ai, "PROMPT_TEMPLATES_PATH", path)
+    ai.load_prompt_templates.cache_clear()
+    ai.get_prompt_template.cache_clear()
+    yield path
+    ai.load_prompt_templates.cache_clear()
+    ai.get_prompt_template.cache_clear()
+
+
+def test_builtin_roles(templates_file):
+    assert ai.get_prompt_template('default').render("你好") == "你好; answer by Chinese"
+    # 代码执行和自定义角色不做修饰
+    assert ai.get_prompt_template('code').render("列出文件") == "列出文件"
+    assert ai.get_prompt_template('translator').render("hello") == "hello"
+
+
+def test_template_file_overrides_builtin(templates_file):
+    templates_file.write_text(json.dumps({
+        'default': {'language': 'English'},
+        'translator': {'prefix': '翻译: ', 'suffix': ' (only the translation)'},
+    }), encoding='utf-8')
+    assert ai.get_prompt_template('default').render("你好") == "你好; answer by English"
+    assert ai.get_prompt_template('translator').render("hello") == "翻译: hello (only the translation)"
+    assert ai.get_prompt_template('code').render("ls") == "ls"
+
+
+def test_unreadable_template_file_falls_back(templates_file, capsys):
+    templates_file.write_text("{not json", encoding='utf-8')
+    assert ai.get_prompt_template('default').render("你好") == "你好; answer by Chinese"
+    assert "模板文件读取失败" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("config", [{'unknown': 1}, {'context': 'everything'}])
+def test_invalid_role_config_falls_back(templates_file, capsys, config):
+    templates_file.write_text(json.dumps({'broken': config}), encoding='utf-8')
+    template = ai.get_prompt_template('broken')
+    assert template.render("问题") == "问题"
+    assert template.format_context is ai.create_param_list
+    assert "模板配置无效" in capsys.readouterr().out
+
+
+def test_problems_context(templates_file):
+    templates_file.write_text(json.dumps({'brief': {'context': 'problems'}}), encoding='utf-8')
+    records = [(1, "问题一", "输出一", "brief"), (2, "问题二", "", "brief")]
+    assert ai.get_prompt_template('brief').format_context(records) == [
+        {"problem": "问题一"}, {"problem": "问题二"}]
+    assert ai.get_prompt_template('default').format_context(records) == [
+        {"problem": "问题一", "output": "输出一"}, {"problem": "问题二"}]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("  hi   there  ", "hi there"),
+    ("中文\u3000\u3000问题", "中文 问题"),
+    ("def f():\n    return  1", "def f():\n    return 1"),
+    ("\n    if x:\n        y()  \n", "if x:\n    y()"),
+])
+def test_normalize_prompt(text, expected):
+    assert ai.normalize_prompt(text) == expected
+
+
+def test_render_keeps_indentation(templates_file):
+    rendered = ai.get_prompt_template('default').render("def f():\n    return  1")
+    assert rendered == "def f():\n    return 1; answer by Chinese"
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+import ai
+
+
+@pytest.fixture
+def cursor(monkeypatch, tmp_path):
+    monkeypatch.setattr(ai, 'DB_PATH', tmp_path / 'test.db')
+    monkeypatch.setattr(ai, '_origin_id', None)
+    cursor = ai.init_db_connection()
+    ai.init_db(cursor)
+    yield cursor
+    ai.close_db_connection()
+
+
+def test_estimate_tokens():
+    assert ai.estimate_tokens('') == 0
+    assert ai.estimate_tokens('中文') == 2
+    assert ai.estimate_tokens('abcdefgh') == 2
+
+
+def test_rollups_match_raw_log(cursor):
+    ai.save_chat_record(cursor, '你好', 'a', '回答内容', 'default')
+    ai.save_chat_record(cursor, 'hello', 'a', 'answer', 'code')
+
+    # 汇总表可以由明细按同一时钟重建
+    cursor.execute("""
+        SELECT substr(timestamp, 1, 13) || ':00', role, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens)
+        FROM usage_log GROUP BY 1, 2 ORDER BY 2
+    """)
+    rebuilt = cursor.fetchall()
+    cursor.execute("SELECT period, role, requests, prompt_tokens, completion_tokens FROM usage_hourly ORDER BY role")
+    assert cursor.fetchall() == rebuilt
+
+    cursor.execute("SELECT substr(timestamp, 1, 10), role, COUNT(*) FROM usage_log GROUP BY 1, 2 ORDER BY 2")
+    rebuilt = cursor.fetchall()
+    cursor.execute("SELECT period, role, requests FROM usage_daily ORDER BY role")
+    assert cursor.fetchall() == rebuilt
+
+
+def test_usage_report_reads_rollups(cursor):
+    ai.save_chat_record(cursor, '你好', 'a', '回答', 'default')
+
+    rows = ai.get_usage_report(cursor, 'hour')
+
+    assert [(row[1], row[2]) for row in rows] == [('default', 1)]
+    assert '合计' in ai.format_usage_report(rows)
+
+
+def test_usage_report_by_session(cursor):
+    ai.start_session(cursor)
+    ai.save_chat_record(cursor, '你好', 'a', '回答', 'default')
+    ai.save_chat_record(cursor, '再问', 'a', '回答', 'default')
+    ai.start_session(cursor)
+    ai.save_chat_record(cursor, 'ls', 'a', 'out', 'code')
+    # 不在会话中的请求不计入
+    cursor.execute("UPDATE sessions SET is_active = 0")
+    ai.save_chat_record(cursor, '单独', 'a', '回答', 'default')
+
+    rows = ai.get_usage_report(cursor, 'session')
+
+    # 最新的会话在前
+    assert [(row[1], row[2]) for row in rows] == [('code', 1), ('default', 2)]
+
+
+def test_context_budget_warning(monkeypatch, capsys):
+    monkeypatch.setattr(ai, 'CONTEXT_BUDGET', 10)
+    param_list = [{"problem": "中文问题" * 5, "output": "输出"}]
+
+    context_bytes = ai.check_context_budget(param_list)
+
+    assert context_bytes == len(json.dumps(param_list).encode('utf-8'))
+    assert '已超过预算 10' in capsys.readouterr().out
+
+
+def test_context_within_budget_is_silent(monkeypatch, capsys):
+    monkeypatch.setattr(ai, 'CONTEXT_BUDGET', 10)
+
+    ai.check_context_budget([{"problem": "短"}])
+
+    assert capsys.readouterr().out == ''